@@ -0,0 +1,32 @@
+"""
+Fixtures and size parametrization of the rppt_core benchmarks.
+
+Sizes go up to 1e7 points and 1e5 classes; set RPPT_BENCH_MAX_POINTS and
+RPPT_BENCH_MAX_CLASSES to cap them on small machines.
+"""
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MAX_POINTS = int(float(os.environ.get('RPPT_BENCH_MAX_POINTS', 1e7)))
+MAX_CLASSES = int(float(os.environ.get('RPPT_BENCH_MAX_CLASSES', 1e5)))
+
+POINT_SIZES = [n for n in (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7) if n <= MAX_POINTS]
+CLASS_SIZES = [n for n in (10, 10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5) if n <= MAX_CLASSES]
+
+
+def pytest_generate_tests(metafunc):
+    if 'n_points' in metafunc.fixturenames:
+        metafunc.parametrize('n_points', POINT_SIZES)
+    if 'n_classes' in metafunc.fixturenames:
+        metafunc.parametrize('n_classes', CLASS_SIZES)
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(20240501)
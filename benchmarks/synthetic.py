@@ -0,0 +1,32 @@
+"""
+Synthetic point clouds and driver layers for the rppt_core benchmarks.
+"""
+import numpy as np
+
+EXTENT = 100000.0
+
+
+def synthetic_points(rng, n_points):
+    """Uniform random points over the extent, with a cluster to make the test non-trivial."""
+    points = rng.uniform(0, EXTENT, size=(n_points, 2))
+    clustered = n_points // 5
+    points[:clustered] = rng.normal(EXTENT / 3, EXTENT / 20, size=(clustered, 2)).clip(0, EXTENT)
+    return points
+
+
+def synthetic_driver(rng, n_classes, cells_per_class=4):
+    """Square grid over the extent with a random class value per cell."""
+    import shapely
+    side = int(np.ceil(np.sqrt(n_classes * cells_per_class)))
+    size = EXTENT / side
+    x, y = np.meshgrid(np.arange(side) * size, np.arange(side) * size)
+    x, y = x.ravel(), y.ravel()
+    polygons = shapely.box(x, y, x + size, y + size)
+    classes = np.concatenate([np.arange(n_classes), rng.integers(0, n_classes, len(polygons) - n_classes)])
+    return polygons, classes
+
+
+def synthetic_shares(rng, n_classes, n_points=10 ** 5):
+    expected = rng.dirichlet(np.ones(n_classes))
+    observed = rng.multinomial(n_points, expected) / n_points
+    return expected, observed
@@ -0,0 +1,74 @@
+"""
+pytest-benchmark suite for rppt_core: throughput of each stage, with the peak
+traced memory of one extra run stored in the benchmark extra_info.
+
+    python -m pytest benchmarks --benchmark-only --benchmark-json=bench.json
+"""
+import tracemalloc
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pytest.importorskip('scipy')
+np = pytest.importorskip('numpy')
+
+import rppt_core  # noqa: E402
+from synthetic import synthetic_driver, synthetic_points, synthetic_shares  # noqa: E402
+
+LOCAL_MAX_ROWS = 10 ** 6
+
+
+def run(benchmark, func, *args, **kwargs):
+    tracemalloc.start()
+    func(*args, **kwargs)
+    benchmark.extra_info['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return benchmark.pedantic(func, args=args, kwargs=kwargs, rounds=3, iterations=1)
+
+
+def test_chi_square(benchmark, rng, n_classes):
+    expected, observed = synthetic_shares(rng, n_classes)
+    run(benchmark, rppt_core.chi_square_test, expected, observed)
+
+
+def test_grouped_test(benchmark, rng, n_classes):
+    n_groups = 100
+    expected, observed = synthetic_shares(rng, n_classes * n_groups)
+    groups = np.repeat(np.arange(n_groups), n_classes)
+    run(benchmark, rppt_core.grouped_test, groups, expected, observed, 0.05)
+
+
+def test_local_test(benchmark, rng, n_classes):
+    # tiles x classes rows capped at LOCAL_MAX_ROWS: fewer tiles for many classes
+    n_tiles = max(1, min(1000, LOCAL_MAX_ROWS // n_classes))
+    expected, observed = synthetic_shares(rng, n_classes * n_tiles)
+    groups = np.repeat(np.arange(n_tiles), n_classes)
+    run(benchmark, rppt_core.local_test, groups, expected, observed, 0.05)
+
+
+def test_simulate_csr(benchmark, rng, n_classes):
+    if n_classes > 10 ** 3:
+        pytest.skip('99,999 replicates are benchmarked up to 1e3 classes')
+    expected, observed = synthetic_shares(rng, n_classes)
+    run(benchmark, rppt_core.simulate_csr, expected, observed, 10 ** 5, 99999, seed=1)
+
+
+def test_study_area(benchmark, rng, n_points):
+    pytest.importorskip('shapely')
+    points = synthetic_points(rng, n_points)
+    run(benchmark, rppt_core.study_area, points, 1000.0, 'convex')
+
+
+def test_clip_and_dissolve(benchmark, rng, n_classes):
+    pytest.importorskip('shapely')
+    polygons, classes = synthetic_driver(rng, n_classes)
+    area = rppt_core.study_area(synthetic_points(rng, 10 ** 4), 1000.0, 'convex')
+    run(benchmark, rppt_core.clip_and_dissolve, polygons, classes, area)
+
+
+def test_count_points(benchmark, rng, n_points, n_classes):
+    pytest.importorskip('shapely')
+    polygons, classes = synthetic_driver(rng, n_classes)
+    points = synthetic_points(rng, n_points)
+    _, geoms = rppt_core.clip_and_dissolve(polygons, classes, rppt_core.study_area(points, 1000.0))
+    run(benchmark, rppt_core.count_points, points, geoms)
@@ -1,12 +1,22 @@
-from qgis.PyQt.QtWidgets import QMessageBox
+from PyQt5.QtCore import QVariant
 from qgis.core import (QgsProcessing, QgsProcessingAlgorithm, QgsProcessingException, 
                        QgsProcessingParameterFeatureSource, QgsProcessingParameterField,
-                       QgsProcessingParameterNumber)
-from scipy.stats import chisquare, norm
+                       QgsProcessingParameterNumber, QgsFeatureRequest,
+                       QgsProcessingParameterMultipleLayers, QgsProcessingParameterFeatureSink,
+                       QgsFeatureSink, QgsFeature, QgsField, QgsFields, QgsWkbTypes,
+                       QgsCoordinateReferenceSystem, QgsAggregateCalculator,
+                       QgsProcessingParameterBoolean, QgsProcessingOutputNumber)
+from scipy.stats import chisquare
+from scipy.stats import chi2 as chi2_dist
 import numpy as np
 
+import csr_simulation
+import rppt_core
+
 class TesteAleatoriedadeProcessingAlgorithm(QgsProcessingAlgorithm):
 
+    DEFAULT_CHUNK_SIZE = 100000
+
     def initAlgorithm(self, config=None):
         self.addParameter(QgsProcessingParameterFeatureSource(
             'layer_input', 'Layer for randomness test (polygon): Systematized Data', 
@@ -20,17 +30,152 @@ class TesteAleatoriedadeProcessingAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterNumber(
             'alpha', 'Alpha value(significance level)', QgsProcessingParameterNumber.Double,
             defaultValue=0.05))
+        self.addParameter(QgsProcessingParameterField(
+            'group_by', 'Batch: group by field (one test per group)', None, 'layer_input',
+            QgsProcessingParameterField.Any, optional=True))
+        self.addParameter(QgsProcessingParameterMultipleLayers(
+            'layer_inputs', 'Batch: more Systematized Data layers (one test per layer)',
+            QgsProcessing.TypeVectorPolygon, optional=True))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            'batch_results', 'Batch results', type=QgsProcessing.TypeVector,
+            createByDefault=True, optional=True, defaultValue=None))
+        self.addParameter(QgsProcessingParameterNumber(
+            'simulations', 'Monte Carlo: number of CSR simulations (0 = asymptotic test only)',
+            QgsProcessingParameterNumber.Integer, defaultValue=0, minValue=0, optional=True))
+        self.addParameter(QgsProcessingParameterField(
+            'counts_field', 'Monte Carlo: number of points field (NUMPOINTS)', 'NUMPOINTS', 'layer_input',
+            QgsProcessingParameterField.Numeric, optional=True))
+        self.addParameter(QgsProcessingParameterNumber(
+            'seed', 'Monte Carlo: random seed', QgsProcessingParameterNumber.Integer,
+            defaultValue=None, optional=True))
+        self.addParameter(QgsProcessingParameterNumber(
+            'sim_workers', 'Monte Carlo: parallel workers', QgsProcessingParameterNumber.Integer,
+            defaultValue=1, minValue=1, optional=True))
+        self.addParameter(QgsProcessingParameterBoolean(
+            'streaming', 'Streaming: read the layer in chunks (bounded memory)', defaultValue=False))
+        self.addParameter(QgsProcessingParameterNumber(
+            'chunk_size', 'Streaming: features per chunk', QgsProcessingParameterNumber.Integer,
+            defaultValue=self.DEFAULT_CHUNK_SIZE, minValue=1, optional=True))
+        self.addOutput(QgsProcessingOutputNumber('chi2', 'Chi-Square Test Statistic'))
+        self.addOutput(QgsProcessingOutputNumber('p_value', 'p-value'))
+        self.addOutput(QgsProcessingOutputNumber('bonferroni_p_value', 'Corrected p-value (Bonferroni correction)'))
+        self.addOutput(QgsProcessingOutputNumber('num_tests', 'Number of themes tested'))
+
+    # the statistics live in rppt_core, without QGIS
+    critical_values = staticmethod(rppt_core.critical_values)
+    normalized_values = staticmethod(rppt_core.normalized_values)
+    exceeds_limits = staticmethod(rppt_core.exceeds_limits)
+    grouped_test = staticmethod(rppt_core.grouped_test)
 
     @staticmethod
-    def critical_values(alpha):
-        upper_limit = norm.ppf(1 - alpha / 2)
-        lower_limit = norm.ppf(alpha / 2)
-        return upper_limit, lower_limit
+    def read_values(data, labels, expected_vals, observed_vals, group_by=None):
+        """
+        Reads the label, expected and observed attributes (no geometry) into arrays,
+        plus the group_by attribute when given (None otherwise).
+        Features whose expected or observed value is not numeric are dropped.
+        Raises QgsProcessingException when data lacks one of the fields.
+        """
+        fields = data.fields()
+        names = [labels, expected_vals, observed_vals] + ([group_by] if group_by else [])
+        missing = [name for name in names if fields.lookupField(name) < 0]
+        if missing:
+            raise QgsProcessingException(f"Layer {data.name()} has no field {', '.join(missing)}")
+        idx_label, idx_exp, idx_obs = (fields.lookupField(name) for name in (labels, expected_vals, observed_vals))
+        idx_group = fields.lookupField(group_by) if group_by else -1
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes([i for i in (idx_label, idx_exp, idx_obs, idx_group) if i >= 0])
+
+        label, expected, observed, group = [], [], [], []
+        for feature in data.getFeatures(request):
+            attrs = feature.attributes()
+            label.append(attrs[idx_label])
+            expected.append(attrs[idx_exp])
+            observed.append(attrs[idx_obs])
+            if idx_group >= 0:
+                group.append(attrs[idx_group])
+
+        as_float = lambda v: float(v) if isinstance(v, (int, float)) else np.nan
+        expected = np.fromiter((as_float(v) for v in expected), dtype=float, count=len(expected))
+        observed = np.fromiter((as_float(v) for v in observed), dtype=float, count=len(observed))
+        valid = ~(np.isnan(expected) | np.isnan(observed))
+        group = np.array(group, dtype=object)[valid] if idx_group >= 0 else None
+        return np.array(label, dtype=object)[valid], expected[valid], observed[valid], group
 
     @staticmethod
-    def normalized_values(values):
-        total = sum(values)
-        return [value / total for value in values] if total != 0 else values
+    def batch_fields():
+        fields = QgsFields()
+        fields.append(QgsField('group', QVariant.String))
+        fields.append(QgsField('label', QVariant.String))
+        for name in ('expected', 'observed', 'residual'):
+            fields.append(QgsField(name, QVariant.Double))
+        fields.append(QgsField('exceeds_alpha', QVariant.Int))
+        fields.append(QgsField('exceeds_bonferroni', QVariant.Int))
+        for name in ('chi2', 'p_value', 'bonferroni_p_value'):
+            fields.append(QgsField(name, QVariant.Double))
+        fields.append(QgsField('num_tests', QVariant.Int))
+        return fields
+
+    def processBatch(self, parameters, context, feedback, labels, expected_vals, observed_vals, alpha, group_by):
+        """
+        Runs the test for every group (group_by value and/or input layer) in one
+        vectorized pass and writes one row per group and class to batch_results.
+        """
+        layers = [self.parameterAsVectorLayer(parameters, 'layer_input', context)]
+        for layer in self.parameterAsLayerList(parameters, 'layer_inputs', context):
+            if layer.id() != layers[0].id():
+                layers.append(layer)
+
+        # groups are keyed by layer position, so layers sharing a name (every temporary
+        # Part 1 output is "Systematized Data") stay apart; the name is only the label
+        layer_names = [layer.name() for layer in layers]
+        keys, group_labels, label, expected, observed = [], {}, [], [], []
+        for position, layer in enumerate(layers):
+            lb, exp, obs, grp = self.read_values(layer, labels, expected_vals, observed_vals, group_by)
+            name = layer.name()
+            if layer_names.count(name) > 1:
+                name = f'{name} [{position + 1}]'
+            if grp is None:
+                keys.extend([(position,)] * len(lb))
+                group_labels[(position,)] = name
+            else:
+                for g in grp:
+                    key = (position, str(g))
+                    keys.append(key)
+                    group_labels[key] = f'{name}:{g}' if len(layers) > 1 else str(g)
+            label.append(lb)
+            expected.append(exp)
+            observed.append(obs)
+
+        group_codes = {}
+        groups = np.fromiter((group_codes.setdefault(key, len(group_codes)) for key in keys), dtype=int, count=len(keys))
+        group_names = [group_labels[key] for key in group_codes]
+        label = np.concatenate(label)
+        group_stats, class_stats = self.grouped_test(groups, np.concatenate(expected), np.concatenate(observed), alpha)
+
+        fields = self.batch_fields()
+        (sink, dest_id) = self.parameterAsSink(parameters, 'batch_results', context, fields,
+                                               QgsWkbTypes.NoGeometry, QgsCoordinateReferenceSystem())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, 'batch_results'))
+
+        for i in range(len(groups)):
+            if feedback.isCanceled():
+                break
+            g = groups[i]
+            feature = QgsFeature(fields)
+            feature.setAttributes([
+                group_names[g], str(label[i]),
+                float(class_stats['expected'][i]), float(class_stats['observed'][i]), float(class_stats['residual'][i]),
+                int(class_stats['exceeds_alpha'][i]), int(class_stats['exceeds_bonferroni'][i]),
+                float(group_stats['chi2'][g]), float(group_stats['p_value'][g]), float(group_stats['bonferroni_p_value'][g]),
+                int(group_stats['num_tests'][g]),
+            ])
+            sink.addFeature(feature, QgsFeatureSink.FastInsert)
+
+        rejected = int((group_stats['p_value'] < alpha).sum())
+        feedback.pushInfo(f"Batch chi-square goodness-of-fit Test: {len(group_names)} groups tested, "
+                          f"null hypothesis rejected in {rejected} (alpha {alpha:.3f}).")
+        return {'batch_results': dest_id}
 
     def processAlgorithm(self, parameters, context, feedback):
         data = self.parameterAsVectorLayer(parameters, 'layer_input', context)
@@ -38,24 +183,57 @@ class TesteAleatoriedadeProcessingAlgorithm(QgsProcessingAlgorithm):
         observed_vals = self.parameterAsString(parameters, 'observed_vals', context)
         labels = self.parameterAsString(parameters, 'labels', context)
         alpha = self.parameterAsDouble(parameters, 'alpha', context)
+        group_by = self.parameterAsString(parameters, 'group_by', context)
 
-        expected = []
-        observed = []
-        label = []
+        if group_by or self.parameterAsLayerList(parameters, 'layer_inputs', context):
+            ignored = [name for name, used in (
+                ('Streaming', self.parameterAsBool(parameters, 'streaming', context)),
+                ('Monte Carlo simulations', self.parameterAsInt(parameters, 'simulations', context) > 0)) if used]
+            if ignored:
+                raise QgsProcessingException(f"Batch mode (group by field or several layers) can't be combined "
+                                             f"with: {', '.join(ignored)}")
+            return self.processBatch(parameters, context, feedback, labels, expected_vals, observed_vals, alpha, group_by)
 
-        for feature in data.getFeatures():
-            exp = feature[expected_vals]
-            obs = feature[observed_vals]
-            label.append(feature[labels])
-            if isinstance(exp, (int, float)) and isinstance(obs, (int, float)):
-                expected.append(float(exp))
-                observed.append(float(obs))
+        if self.parameterAsBool(parameters, 'streaming', context):
+            return self.processStreaming(parameters, context, feedback, data, labels, expected_vals, observed_vals, alpha)
+
+        label, expected, observed, _ = self.read_values(data, labels, expected_vals, observed_vals)
 
         expected = self.normalized_values(expected)
         observed = self.normalized_values(observed)
 
         chi2, p_valor = chisquare(observed, f_exp=expected)
         num_tests = len(expected)
+        bonferroni_alpha = alpha / num_tests
+
+        bonferroni_upper_limit, bonferroni_lower_limit = self.critical_values(bonferroni_alpha)
+        alpha_upper_limit, alpha_lower_limit = self.critical_values(alpha)
+
+        res_std = (observed - expected) / np.sqrt(expected)
+        excessos = self.exceeds_limits(res_std, alpha_upper_limit, alpha_lower_limit)
+        excessos_bonferroni = self.exceeds_limits(res_std, bonferroni_upper_limit, bonferroni_lower_limit)
+
+        results = self.report(feedback, chi2, p_valor, num_tests, alpha,
+                              list(zip(label[excessos], res_std[excessos])),
+                              list(zip(label[excessos_bonferroni], res_std[excessos_bonferroni])))
+
+        simulations = self.parameterAsInt(parameters, 'simulations', context)
+        if simulations > 0:
+            mensagem, sim = self.monte_carlo_test(parameters, context, data, label, expected, observed,
+                                                  simulations, alpha, bonferroni_alpha)
+            feedback.pushInfo(" ")
+            feedback.pushInfo(" ")
+            feedback.pushInfo(mensagem)
+            results['mc_p_value'] = sim['p_value']
+
+        return results
+
+    def report(self, feedback, chi2, p_valor, num_tests, alpha, excessos, excessos_bonferroni):
+        """
+        Pushes the test results without and with Bonferroni correction; excessos and
+        excessos_bonferroni are the (label, residual) pairs exceeding each critical value.
+        Returns the results as the algorithm outputs.
+        """
         bonferroni_p_value = p_valor * num_tests
         bonferroni_alpha = alpha / num_tests
 
@@ -67,16 +245,11 @@ class TesteAleatoriedadeProcessingAlgorithm(QgsProcessingAlgorithm):
         mensagem += f"p-value: {p_valor:.6f}\n"
         mensagem += f"Critical values (without Bonferroni correction) (alpha {alpha:.3f}): Upper limit: {alpha_upper_limit:.3f}, Lower limit: {alpha_lower_limit:.3f}\n"
 
-        res_std = (np.array(observed) - np.array(expected)) / np.sqrt(expected)
-        res_std_lb = list(zip(label, res_std))
-
         mensagem_excessos = "Residual values that exceed critical values:\n"
-        contagem_excessos = 0
+        contagem_excessos = len(excessos)
 
-        for label1, res in res_std_lb:
-            if res > alpha_upper_limit or res < alpha_lower_limit:  # Use appropriate critical values here
-                mensagem_excessos += f"The residue observed in theme '{label1}' exceeds the limit of critical values of {res:.4f}. This value indicates that it influences the point pattern.\n"
-                contagem_excessos += 1
+        for label1, res in excessos:
+            mensagem_excessos += f"The residue observed in theme '{label1}' exceeds the limit of critical values of {res:.4f}. This value indicates that it influences the point pattern.\n"
 
         if contagem_excessos == 0:
             mensagem_excessos = "None of the themes analyzed has residual values that exceed critical limits.\n"
@@ -100,12 +273,10 @@ class TesteAleatoriedadeProcessingAlgorithm(QgsProcessingAlgorithm):
         mensagem_bonferroni += f"Critical values with Bonferroni (corrected alpha {bonferroni_alpha:.3f}): Upper limit: {bonferroni_upper_limit:.3f}, Lower limit: {bonferroni_lower_limit:.3f}\n"
 
         mensagem_excessos_bonferroni = "Residual values that exceed critical values (with Bonferroni correction):\n"
-        contagem_excessos_bonferroni = 0
+        contagem_excessos_bonferroni = len(excessos_bonferroni)
 
-        for label2, res in res_std_lb:
-            if res > bonferroni_upper_limit or res < bonferroni_lower_limit:
-                mensagem_excessos_bonferroni += f"The residue observed in theme '{label2}' exceeds the limit of critical values of {res:.4f}. This value indicates that it influences the point pattern.\n"
-                contagem_excessos_bonferroni += 1
+        for label2, res in excessos_bonferroni:
+            mensagem_excessos_bonferroni += f"The residue observed in theme '{label2}' exceeds the limit of critical values of {res:.4f}. This value indicates that it influences the point pattern.\n"
 
         if contagem_excessos_bonferroni == 0:
             mensagem_excessos_bonferroni = "None of the themes analyzed has residual values that exceed critical limits.\n"
@@ -119,7 +290,119 @@ class TesteAleatoriedadeProcessingAlgorithm(QgsProcessingAlgorithm):
         
         feedback.pushInfo("Chi-Square goodness-of-fit Test (with Bonferroni correction)\n" + mensagem_bonferroni)
 
-        return {}
+        return {
+            'chi2': float(chi2),
+            'p_value': float(p_valor),
+            'bonferroni_p_value': float(bonferroni_p_value),
+            'num_tests': int(num_tests),
+            'exceeding': [[str(lb), float(res)] for lb, res in excessos],
+            'exceeding_bonferroni': [[str(lb), float(res)] for lb, res in excessos_bonferroni],
+        }
+
+    @staticmethod
+    def iter_value_chunks(data, labels, expected_vals, observed_vals, chunk_size):
+        """
+        Yields (label, expected, observed) arrays of at most chunk_size features,
+        reading no geometry. Features whose values are not numeric are dropped.
+        """
+        fields = data.fields()
+        idx_label, idx_exp, idx_obs = (fields.lookupField(name) for name in (labels, expected_vals, observed_vals))
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes([idx_label, idx_exp, idx_obs])
+
+        label = []
+        expected = np.empty(chunk_size)
+        observed = np.empty(chunk_size)
+        for feature in data.getFeatures(request):
+            attrs = feature.attributes()
+            exp, obs = attrs[idx_exp], attrs[idx_obs]
+            if not (isinstance(exp, (int, float)) and isinstance(obs, (int, float))):
+                continue
+            expected[len(label)] = exp
+            observed[len(label)] = obs
+            label.append(attrs[idx_label])
+            if len(label) == chunk_size:
+                yield label, expected, observed
+                label = []
+        if label:
+            yield label, expected[:len(label)], observed[:len(label)]
+
+    def processStreaming(self, parameters, context, feedback, data, labels, expected_vals, observed_vals, alpha):
+        """
+        Two chunked passes with memory independent of the number of classes: the
+        first sums the expected and observed values, the second accumulates the
+        chi-square statistic and keeps only the residuals exceeding the limits.
+        """
+        chunk_size = self.parameterAsInt(parameters, 'chunk_size', context) or self.DEFAULT_CHUNK_SIZE
+
+        num_tests = 0
+        expected_total = 0.0
+        observed_total = 0.0
+        for label, expected, observed in self.iter_value_chunks(data, labels, expected_vals, observed_vals, chunk_size):
+            if feedback.isCanceled():
+                return {}
+            num_tests += len(label)
+            expected_total += expected.sum()
+            observed_total += observed.sum()
+        expected_total = expected_total or 1.0
+        observed_total = observed_total or 1.0
+
+        alpha_upper_limit, alpha_lower_limit = self.critical_values(alpha)
+        bonferroni_upper_limit, bonferroni_lower_limit = self.critical_values(alpha / num_tests)
+
+        chi2 = 0.0
+        excessos = []
+        excessos_bonferroni = []
+        for label, expected, observed in self.iter_value_chunks(data, labels, expected_vals, observed_vals, chunk_size):
+            if feedback.isCanceled():
+                return {}
+            expected /= expected_total
+            observed /= observed_total
+            res_std = (observed - expected) / np.sqrt(expected)
+            chi2 += np.dot(res_std, res_std)
+            for i in np.flatnonzero(self.exceeds_limits(res_std, alpha_upper_limit, alpha_lower_limit)):
+                excessos.append((label[i], res_std[i]))
+            for i in np.flatnonzero(self.exceeds_limits(res_std, bonferroni_upper_limit, bonferroni_lower_limit)):
+                excessos_bonferroni.append((label[i], res_std[i]))
+
+        p_valor = chi2_dist.sf(chi2, num_tests - 1)
+        results = self.report(feedback, chi2, p_valor, num_tests, alpha, excessos, excessos_bonferroni)
+
+        if self.parameterAsInt(parameters, 'simulations', context) > 0:
+            feedback.pushInfo("The Monte Carlo test needs all classes in memory and is not run in streaming mode.")
+        return results
+
+    def monte_carlo_test(self, parameters, context, data, label, expected, observed, simulations, alpha, bonferroni_alpha):
+        """Runs the CSR simulation and returns (report message, simulation results)."""
+        counts_field = self.parameterAsString(parameters, 'counts_field', context)
+        if not counts_field or data.fields().lookupField(counts_field) < 0:
+            raise QgsProcessingException('The Monte Carlo test needs the number of points field (NUMPOINTS)')
+        n_points, ok = data.aggregate(QgsAggregateCalculator.Sum, counts_field)
+        if not ok or not n_points:
+            raise QgsProcessingException(f"Could not sum the number of points in field '{counts_field}'")
+
+        seed = self.parameterAsInt(parameters, 'seed', context) if parameters.get('seed') is not None else None
+        workers = self.parameterAsInt(parameters, 'sim_workers', context) or 1
+        sim = csr_simulation.simulate_csr(expected, observed, n_points, simulations, seed, workers)
+
+        mensagem = f"Monte Carlo Chi-Square Test ({simulations} CSR simulations, {int(n_points)} points)\n"
+        mensagem += f"Chi-Square Test Statistic: {sim['chi2']:.4f}\n"
+        mensagem += f"Empirical p-value: {sim['p_value']:.6f}\n"
+
+        for title, limit in (("without Bonferroni correction", alpha), ("with Bonferroni correction", bonferroni_alpha)):
+            fora = sim['class_p_value'] < limit
+            mensagem += f"Themes with empirical residual p-value below {limit:.4f} ({title}):\n"
+            if not fora.any():
+                mensagem += "None of the themes analyzed has residual values outside the simulated distribution.\n"
+            for label1, res, lower, upper, p in zip(label[fora], sim['residual'][fora], sim['envelope_lower'][fora],
+                                                    sim['envelope_upper'][fora], sim['class_p_value'][fora]):
+                mensagem += f"The residue observed in theme '{label1}' ({res:.4f}, simulation envelope {lower:.4f} to {upper:.4f}) has empirical p-value {p:.6f}.\n"
+
+        if sim['p_value'] < alpha:
+            mensagem += "Reject the null hypothesis: the point pattern differs from complete spatial randomness."
+        else:
+            mensagem += "Fail to reject the null hypothesis: the point pattern does not differ from complete spatial randomness."
+        return mensagem, sim
 
     def name(self):
         return 'Spatial_Randomness_Test_p2'
@@ -137,7 +420,16 @@ class TesteAleatoriedadeProcessingAlgorithm(QgsProcessingAlgorithm):
         return TesteAleatoriedadeProcessingAlgorithm()
 
     def shortHelpString(self):
-        return ("<font size='4'><b>This tool tests for spatial randomness in point patterns within polygons using the Chi-square test, providing results both with and without Bonferroni correction.</b></font>")
+        return ("<font size='4'><b>This tool tests for spatial randomness in point patterns within polygons using the Chi-square test, providing results both with and without Bonferroni correction.</b></font>"
+                "<p>Batch mode: set a group by field and/or more Systematized Data layers to test every group "
+                "(or layer) in a single pass. One row per group and class is written to Batch results, with the "
+                "residuals, both critical-value exceedances, the chi-square statistic and the p-values.</p>"
+                "<p>Monte Carlo: with a number of simulations, the observed number of points (NUMPOINTS field) is "
+                "distributed over the themes by area share to build the CSR distribution of the statistic. Reports "
+                "the empirical p-value and, per theme, the simulated residual envelope and empirical p-value. "
+                "Use it when themes have small expected counts.</p>"
+                "<p>Streaming: reads the layer in chunks in two passes (totals, then statistic and residuals), so "
+                "memory does not grow with the number of themes.</p>")
 
     def helpUrl(self):
         return 'https://yourorganization.com/help'
@@ -0,0 +1,85 @@
+"""
+Monte Carlo significance for the Chi-square goodness-of-fit Test (Part 2).
+
+Simulates complete spatial randomness (CSR): the observed number of points is
+distributed over the classes by their area share with one multinomial draw
+per chunk of replicates. Pure NumPy, no QGIS.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_SIMULATIONS = 99999
+CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def _chunk_sizes(n_sim, n_classes, chunk_bytes=CHUNK_BYTES):
+    # counts, shares and residuals (3 float64 arrays) for every replicate of the chunk
+    chunk = max(1, chunk_bytes // (24 * max(n_classes, 1)))
+    sizes = [chunk] * (n_sim // chunk)
+    if n_sim % chunk:
+        sizes.append(n_sim % chunk)
+    return sizes
+
+
+def _simulate_chunk(seed, size, n_points, expected, chi2_obs, res_obs):
+    rng = np.random.default_rng(seed)
+    sqrt_expected = np.sqrt(expected)
+    res = rng.multinomial(n_points, expected, size=size) / n_points
+    res -= expected
+    res /= sqrt_expected
+    chi2 = np.einsum('ij,ij->i', res, res)
+    return {
+        'chi2_exceed': int((chi2 >= chi2_obs - 1e-12).sum()),
+        'lower': res.min(axis=0),
+        'upper': res.max(axis=0),
+        'res_above': (res >= res_obs - 1e-12).sum(axis=0),
+        'res_below': (res <= res_obs + 1e-12).sum(axis=0),
+    }
+
+
+def simulate_csr(expected, observed, n_points, n_sim=DEFAULT_SIMULATIONS, seed=None, workers=1,
+                 chunk_bytes=CHUNK_BYTES):
+    """
+    Monte Carlo chi-square test under CSR.
+
+    expected and observed are the class shares (normalized to 1), n_points the
+    observed number of points. Replicates are drawn in chunks of at most
+    chunk_bytes, each chunk with its own generator spawned from seed, so the
+    result only depends on seed (not on workers).
+
+    Returns a dict with the observed statistic and residuals, the empirical
+    p-value, the per-class residual envelope (min/max over the replicates)
+    and the per-class two-sided empirical p-values.
+    """
+    expected = np.asarray(expected, dtype=float)
+    observed = np.asarray(observed, dtype=float)
+    n_points = int(round(n_points))
+
+    res_obs = (observed - expected) / np.sqrt(expected)
+    chi2_obs = float(np.dot(res_obs, res_obs))
+
+    sizes = _chunk_sizes(n_sim, len(expected), chunk_bytes)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(s, size, n_points, expected, chi2_obs, res_obs) for s, size in zip(seeds, sizes)]
+    if workers > 1:
+        # NumPy draws and array reductions release the GIL
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(lambda a: _simulate_chunk(*a), args))
+    else:
+        chunks = [_simulate_chunk(*a) for a in args]
+
+    chi2_exceed = sum(c['chi2_exceed'] for c in chunks)
+    res_above = np.sum([c['res_above'] for c in chunks], axis=0)
+    res_below = np.sum([c['res_below'] for c in chunks], axis=0)
+    class_p_value = np.minimum(1.0, 2 * (np.minimum(res_above, res_below) + 1) / (n_sim + 1))
+
+    return {
+        'n_sim': n_sim,
+        'chi2': chi2_obs,
+        'p_value': (chi2_exceed + 1) / (n_sim + 1),
+        'residual': res_obs,
+        'envelope_lower': np.min([c['lower'] for c in chunks], axis=0),
+        'envelope_upper': np.max([c['upper'] for c in chunks], axis=0),
+        'class_p_value': class_p_value,
+    }
@@ -0,0 +1,92 @@
+"""
+Saved study-area state of Spatial Randomness Part 1 for incremental runs.
+
+A JSON file with the study area, the clipped and dissolved classes (WKB), their
+areas and point counts, and the last point feature id already counted. It is
+keyed by everything that changes the overlay except the appended points: the
+points and driver sources (and driver modification time), the aggregation field,
+the delimitation settings and the area calculation.
+"""
+import hashlib
+import json
+import os
+
+from qgis.core import QgsGeometry
+
+
+def class_value(value):
+    """
+    Class value as JSON: numbers and strings as they are, NULL as null and any
+    other type (dates, times) as the text the sinks write.
+    """
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if hasattr(value, 'isNull') and value.isNull():
+        return None
+    return str(value)
+
+
+def _geometry(wkb_hex):
+    geom = QgsGeometry()
+    geom.fromWkb(bytes.fromhex(wkb_hex))
+    return geom
+
+
+class IncrementalState:
+    """State file of one analysis (append-only point layer)."""
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def key(points_layer, driver_layer, field_name, settings):
+        """settings: delimitation, buffer and area options, in a fixed order."""
+        digest = hashlib.sha256()
+        parts = [points_layer.source(), driver_layer.source(), field_name]
+        path = driver_layer.source().split('|')[0]
+        if os.path.isfile(path):
+            parts.append(repr(os.path.getmtime(path)))
+        parts.extend(repr(s) for s in settings)
+        for part in parts:
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def load(self, key):
+        """
+        Returns a dict with last_fid, num_points, area, classes, counts and areas,
+        or None when there is no state for key.
+        """
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('key') != key:
+            return None
+        classes, counts, areas = {}, {}, {}
+        for value, wkb_hex, count, area in data['classes']:
+            classes[value] = _geometry(wkb_hex)
+            counts[value] = count
+            areas[value] = area
+        return {
+            'last_fid': data['last_fid'],
+            'num_points': data['num_points'],
+            'area': _geometry(data['area']),
+            'classes': classes,
+            'counts': counts,
+            'areas': areas,
+        }
+
+    def save(self, key, last_fid, num_points, area, classes, counts, areas):
+        data = {
+            'key': key,
+            'last_fid': last_fid,
+            'num_points': num_points,
+            'area': bytes(area.asWkb()).hex(),
+            'classes': [[class_value(value), bytes(geom.asWkb()).hex(), counts.get(value, 0), areas[value]]
+                        for value, geom in classes.items()],
+        }
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,936 @@
+"""
+Fused overlay engine for Spatial Randomness Part 1.
+
+Runs the buffer -> clip -> aggregate -> count -> field calculator chain of
+AleatorioProcessingAlgorithm in memory, so only the final systematized
+data is written to a sink.
+"""
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import accumulate
+
+import numpy as np
+from PyQt5.QtCore import QVariant
+from qgis.core import (Qgis,
+                       QgsCoordinateTransform,
+                       QgsDistanceArea,
+                       QgsFeature,
+                       QgsFeatureRequest,
+                       QgsField,
+                       QgsFields,
+                       QgsGeometry,
+                       QgsMemoryProviderUtils,
+                       QgsPointXY,
+                       QgsProcessingMultiStepFeedback,
+                       QgsRectangle,
+                       QgsSpatialIndex,
+                       QgsWkbTypes,
+                       NULL)
+
+import rppt_core
+
+try:
+    CAP_ROUND, JOIN_ROUND = Qgis.EndCapStyle.Round, Qgis.JoinStyle.Round
+except AttributeError:  # QGIS < 3.30
+    CAP_ROUND, JOIN_ROUND = QgsGeometry.CapRound, QgsGeometry.JoinStyleRound
+
+BUFFER_SEGMENTS = 5
+BUFFER_MITER_LIMIT = 2
+TILE_MAX_VERTICES = 256
+LAYER_SIZE_SAMPLE = 100
+AREA_CONTEXT, AREA_PLANAR, AREA_ELLIPSOIDAL = range(3)
+TILES_NONE, TILES_SQUARE, TILES_HEXAGON = range(3)
+DEFAULT_ELLIPSOID = 'EPSG:7030'  # WGS84
+TILE_MAX_DEPTH = 8
+HULL_CHUNK_SIZE = 100000
+
+
+def steps(feedback, count):
+    """Splits the progress of feedback in count steps (None stays None)."""
+    return QgsProcessingMultiStepFeedback(count, feedback) if feedback is not None else None
+
+
+def study_area(hull_layer, distance, segments=BUFFER_SEGMENTS):
+    """Buffers every hull feature and dissolves them (native:buffer, DISSOLVE=True)."""
+    parts = []
+    for feature in hull_layer.getFeatures(QgsFeatureRequest().setNoAttributes()):
+        geom = feature.geometry()
+        if geom.isEmpty():
+            continue
+        parts.append(geom.buffer(distance, segments, CAP_ROUND, JOIN_ROUND, BUFFER_MITER_LIMIT))
+    if not parts:
+        return QgsGeometry()
+    return QgsGeometry.unaryUnion(parts)
+
+
+def convex_vertices(points):
+    """Distinct vertices of the convex hull of a list of QgsPointXY."""
+    hull = QgsGeometry.fromMultiPointXY(points).convexHull()
+    return list({(v.x(), v.y()): QgsPointXY(v.x(), v.y()) for v in hull.vertices()}.values())
+
+
+def hull_candidates(points, concave, cell_size, chunk_size=HULL_CHUNK_SIZE, feedback=None):
+    """
+    Streams the points in chunks of chunk_size and keeps only what the hull needs:
+    the vertices of the convex hull (it decides the envelope, oriented rectangle
+    and enclosing circle) and, for the concave hull, one point per grid cell of
+    cell_size, so any dropped point lies within a cell diagonal of a kept one.
+
+    Returns (list of QgsPointXY, number of points read).
+    """
+    hull = []
+    chunk = []
+    cells = {}
+    read = 0
+    total = 100.0 / points.featureCount() if points.featureCount() else 0
+    for feature in points.getFeatures(QgsFeatureRequest().setNoAttributes()):
+        if feedback is not None:
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(read * total)
+        for vertex in feature.geometry().vertices():
+            point = QgsPointXY(vertex.x(), vertex.y())
+            chunk.append(point)
+            if concave:
+                cells.setdefault((math.floor(point.x() / cell_size), math.floor(point.y() / cell_size)), point)
+        read += 1
+        if len(chunk) >= chunk_size:
+            hull = convex_vertices(hull + chunk)
+            chunk = []
+    if chunk:
+        hull = convex_vertices(hull + chunk)
+    candidates = {(p.x(), p.y()): p for p in hull}
+    for point in cells.values():
+        candidates.setdefault((point.x(), point.y()), point)
+    return list(candidates.values()), read
+
+
+def points_layer(points, crs):
+    """Memory point layer (no attributes) with the given QgsPointXY."""
+    layer = QgsMemoryProviderUtils.createMemoryLayer('Points', QgsFields(), QgsWkbTypes.Point, crs)
+    features = []
+    for point in points:
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromPointXY(point))
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def layer_bytes(layer, sample=LAYER_SIZE_SAMPLE):
+    """
+    Approximate in-memory size of a layer (geometry WKB plus attribute values):
+    the feature count times the average size of its first sample features, so
+    the layer isn't read again in full.
+    """
+    count = layer.featureCount()
+    if count <= 0:
+        return 0
+    total = sampled = 0
+    for feature in layer.getFeatures(QgsFeatureRequest().setLimit(sample)):
+        total += feature.geometry().wkbSize()
+        total += sum(len(value) if isinstance(value, str) else 8 for value in feature.attributes())
+        sampled += 1
+    return total * count // sampled if sampled else 0
+
+
+def layer_geometry(layer):
+    """Returns the union of all geometries of layer."""
+    geoms = [f.geometry() for f in layer.getFeatures(QgsFeatureRequest().setNoAttributes())
+             if not f.geometry().isEmpty()]
+    return QgsGeometry.unaryUnion(geoms) if geoms else QgsGeometry()
+
+
+def feature_stats(source):
+    """Returns (number of features, number of vertices) of a layer or feature source."""
+    features = vertices = 0
+    for feature in source.getFeatures(QgsFeatureRequest().setNoAttributes()):
+        features += 1
+        if feature.hasGeometry():
+            vertices += feature.geometry().constGet().nCoordinates()
+    return features, vertices
+
+
+def geometry_stats(geoms):
+    """Returns (number of geometries, number of vertices) of an iterable of geometries."""
+    geoms = [geom for geom in geoms if geom is not None]
+    return len(geoms), sum(geom.constGet().nCoordinates() for geom in geoms if not geom.isEmpty())
+
+
+def transformed(geom, source_crs, dest_crs, context):
+    """Returns a copy of geom reprojected from source_crs to dest_crs."""
+    geom = QgsGeometry(geom)
+    if source_crs != dest_crs:
+        geom.transform(QgsCoordinateTransform(source_crs, dest_crs, context.transformContext()))
+    return geom
+
+
+class AreaTiles:
+    """
+    Study area split by tiled_parts, so a driver polygon is intersected only with
+    the small tiles its bounding box overlaps instead of the whole buffer.
+    """
+
+    def __init__(self, area, max_vertices=TILE_MAX_VERTICES, tiles=None):
+        if tiles is None:
+            tiles = [part for part, _ in tiled_parts(area, max_vertices)]
+        self.tiles = tiles
+        self.index = QgsSpatialIndex()
+        for i, tile in enumerate(tiles):
+            self.index.addFeature(i, tile.boundingBox())
+
+    def copy(self):
+        """Deep copy, for use in another thread."""
+        return AreaTiles(None, tiles=[QgsGeometry(tile.constGet().clone()) for tile in self.tiles])
+
+    def intersection(self, geom):
+        """
+        Same result as geom.intersection(area): the pieces cut by the tiles are
+        unioned again, so no seams remain along the tile edges.
+        """
+        parts = []
+        tiles = 0
+        for i in self.index.intersects(geom.boundingBox()):
+            piece = geom.intersection(self.tiles[i])
+            piece.convertGeometryCollectionToSubclass(QgsWkbTypes.PolygonGeometry)
+            if not piece.isEmpty():
+                parts.extend(piece.asGeometryCollection())
+                tiles += 1
+        if not parts:
+            return QgsGeometry()
+        if tiles == 1:
+            return QgsGeometry.collectGeometry(parts)
+        geom = QgsGeometry.unaryUnion(parts)
+        geom.convertGeometryCollectionToSubclass(QgsWkbTypes.PolygonGeometry)
+        return geom
+
+
+def clip(geom, area):
+    """Intersection of a driver polygon with the study area (a geometry or AreaTiles)."""
+    if isinstance(area, AreaTiles):
+        return area.intersection(geom)
+    geom = geom.intersection(area)
+    geom.convertGeometryCollectionToSubclass(QgsWkbTypes.PolygonGeometry)
+    return geom
+
+
+def simplify_stats():
+    return {'features': 0, 'vertices_before': 0, 'vertices_after': 0,
+            'area_before': 0.0, 'area_change': 0.0, 'max_relative_change': 0.0}
+
+
+def simplified(geom, tolerance, stats=None):
+    """
+    Topology-preserving simplification of one driver polygon (GEOS
+    TopologyPreserveSimplify: rings stay valid, but boundaries shared with other
+    features may drift apart by up to tolerance). stats (see simplify_stats)
+    accumulates the vertices and the area change.
+    """
+    result = geom.simplify(tolerance)
+    if result.isNull() or result.isEmpty():
+        return geom
+    if stats is not None:
+        before, after = geom.area(), result.area()
+        stats['features'] += 1
+        stats['vertices_before'] += geom.constGet().nCoordinates()
+        stats['vertices_after'] += result.constGet().nCoordinates()
+        stats['area_before'] += before
+        stats['area_change'] += abs(after - before)
+        if before:
+            stats['max_relative_change'] = max(stats['max_relative_change'], abs(after - before) / before)
+    return result
+
+
+def simplify_report(stats, tolerance):
+    """One line summary of the simplification error."""
+    vertices = 100.0 * stats['vertices_after'] / stats['vertices_before'] if stats['vertices_before'] else 100.0
+    area = stats['area_change'] / stats['area_before'] if stats['area_before'] else 0.0
+    return (f"Driver simplified with tolerance {tolerance:g}: {stats['features']} polygons, "
+            f"{stats['vertices_before']} -> {stats['vertices_after']} vertices ({vertices:.1f}%), "
+            f"area change {area:.4%} of the total, at most {stats['max_relative_change']:.4%} on one polygon")
+
+
+def driver_features(driver, area, attributes, feedback=None, tolerance=0, stats=None):
+    """
+    Yields (feature, geometry, fully inside area) for the driver polygons
+    intersecting area (already in the driver CRS): the bounding box is filtered
+    by the provider spatial index and the exact test uses a prepared engine.
+    With a tolerance, the kept geometries are simplified first.
+    """
+    engine = prepared_engine(area)
+
+    request = QgsFeatureRequest().setFilterRect(area.boundingBox())
+    request.setSubsetOfAttributes(attributes, driver.fields())
+    total = 100.0 / driver.featureCount() if driver.featureCount() else 0
+
+    for current, feature in enumerate(driver.getFeatures(request)):
+        if feedback is not None:
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(current * total)
+
+        geom = feature.geometry()
+        if geom.isEmpty() or not engine.intersects(geom.constGet()):
+            continue
+        if tolerance:
+            geom = simplified(geom, tolerance, stats)
+        yield feature, geom, engine.contains(geom.constGet())
+
+
+def driver_pieces(driver, field_name, area, feedback=None, tolerance=0, stats=None):
+    """
+    Reads the driver polygons intersecting area (already in the driver CRS),
+    grouped per field_name value in order of first appearance.
+
+    Returns a dict {class value: [(geometry, fully inside area)]}.
+    """
+    pieces = {}
+    for feature, geom, inside in driver_features(driver, area, [field_name], feedback, tolerance, stats):
+        value = feature[field_name]
+        pieces.setdefault(None if value == NULL else value, []).append((geom, inside))
+    return pieces
+
+
+def dissolve_pieces(pieces, area):
+    """
+    Clips the pieces not fully inside area (a geometry or AreaTiles) and
+    dissolves them (native:clip + native:aggregate for one class). Returns None
+    when nothing is left.
+    """
+    geoms = []
+    for geom, inside in pieces:
+        if not inside:
+            geom = clip(geom, area)
+            if geom.isEmpty():
+                continue
+        geoms.append(geom)
+    return QgsGeometry.unaryUnion(geoms) if geoms else None
+
+
+def clip_and_dissolve(driver, field_name, area, context, feedback=None, tiled=False, tolerance=0, stats=None):
+    """
+    Clips the driver polygons by area (already in the driver CRS) and dissolves
+    the pieces per field_name value (native:clip + native:aggregate). tiled clips
+    against AreaTiles; tolerance simplifies the driver polygons first.
+
+    Returns a dict {class value: dissolved geometry} in order of first appearance.
+    """
+    feedback = steps(feedback, 2)
+    pieces = driver_pieces(driver, field_name, area, feedback, tolerance, stats)
+    if feedback is not None:
+        feedback.setCurrentStep(1)
+    clip_area = AreaTiles(area) if tiled else area
+    classes = {}
+    for current, (value, class_pieces) in enumerate(pieces.items()):
+        if feedback is not None:
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(100.0 * current / len(pieces))
+        geom = dissolve_pieces(class_pieces, clip_area)
+        if geom is not None:
+            classes[value] = geom
+    return classes
+
+
+def clip_layer(driver, area, feedback=None, tiled=False, tolerance=0, stats=None):
+    """
+    native:clip of the driver by area (already in the driver CRS) as a memory
+    layer with the driver fields; polygons fully inside area are not clipped.
+    """
+    clip_area = AreaTiles(area) if tiled else area
+    layer = QgsMemoryProviderUtils.createMemoryLayer('Clipped', driver.fields(),
+                                                     QgsWkbTypes.multiType(driver.wkbType()), driver.sourceCrs())
+    features = []
+    for feature, geom, inside in driver_features(driver, area, driver.fields().names(), feedback, tolerance, stats):
+        if not inside:
+            geom = clip(geom, clip_area)
+            if geom.isEmpty():
+                continue
+        geom.convertToMultiType()
+        out = QgsFeature(feature)
+        out.setGeometry(geom)
+        features.append(out)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def classes_layer(classes, field_name, crs):
+    """Memory layer with one feature per class, shaped like the native:aggregate output."""
+    fields = QgsFields()
+    fields.append(QgsField(field_name, QVariant.String, 'text', 250))
+    layer = QgsMemoryProviderUtils.createMemoryLayer('Aggregate', fields, QgsWkbTypes.MultiPolygon, crs)
+    features = []
+    for value, geom in classes.items():
+        feature = QgsFeature(fields)
+        geom = QgsGeometry(geom)
+        geom.convertToMultiType()
+        feature.setGeometry(geom)
+        feature.setAttributes([None if value is None else str(value)])
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def layer_classes(layer, field_name):
+    """Reads back {class value: geometry} from an aggregated layer."""
+    classes = {}
+    for feature in layer.getFeatures():
+        value = feature[field_name]
+        classes[None if value == NULL else value] = feature.geometry()
+    return classes
+
+
+def tiled_parts(geom, max_vertices=TILE_MAX_VERTICES, max_depth=TILE_MAX_DEPTH):
+    """
+    Splits geom into single polygons and quarters the parts having more than
+    max_vertices vertices until they are small enough (or max_depth is reached).
+
+    Returns a list of (part, was_split) tuples.
+    """
+    parts = []
+    stack = [(part, 0) for part in geom.asGeometryCollection()]
+    while stack:
+        part, depth = stack.pop()
+        if part.isEmpty():
+            continue
+        if depth >= max_depth or part.constGet().nCoordinates() <= max_vertices:
+            parts.append((part, depth > 0))
+            continue
+        bbox = part.boundingBox()
+        center = bbox.center()
+        for rect in (QgsRectangle(bbox.xMinimum(), bbox.yMinimum(), center.x(), center.y()),
+                     QgsRectangle(center.x(), bbox.yMinimum(), bbox.xMaximum(), center.y()),
+                     QgsRectangle(bbox.xMinimum(), center.y(), center.x(), bbox.yMaximum()),
+                     QgsRectangle(center.x(), center.y(), bbox.xMaximum(), bbox.yMaximum())):
+            piece = part.intersection(QgsGeometry.fromRect(rect))
+            piece.convertGeometryCollectionToSubclass(QgsWkbTypes.PolygonGeometry)
+            stack.extend((sub, depth + 1) for sub in piece.asGeometryCollection())
+    return parts
+
+
+def prepared_engine(geom):
+    """Returns a prepared GEOS engine for geom."""
+    engine = QgsGeometry.createGeometryEngine(geom.constGet())
+    engine.prepareGeometry()
+    return engine
+
+
+class ClassIndex:
+    """
+    R-tree over the class polygons, tiled into small pieces with prepared
+    geometry engines, for fast point-in-polygon tests.
+    """
+
+    def __init__(self, classes, max_vertices=TILE_MAX_VERTICES):
+        self.classes = classes
+        self.index = QgsSpatialIndex()
+        self.pieces = []
+        self.engines = {}
+        for value, geom in classes.items():
+            for part, was_split in tiled_parts(geom, max_vertices):
+                self.index.addFeature(len(self.pieces), part.boundingBox())
+                self.pieces.append((value, prepared_engine(part), was_split))
+
+    def class_engine(self, value):
+        """Prepared engine of the whole class geometry, built on first use."""
+        if value not in self.engines:
+            self.engines[value] = prepared_engine(self.classes[value])
+        return self.engines[value]
+
+    def containing(self, geom):
+        """Returns the set of class values whose geometry contains geom."""
+        found = set()
+        undecided = set()
+        multipart = geom.isMultipart()
+        for piece_id in self.index.intersects(geom.boundingBox()):
+            value, engine, was_split = self.pieces[piece_id]
+            if value in found:
+                continue
+            if multipart:
+                # parts of a multipoint may fall in different tiles
+                undecided.add(value)
+            elif engine.contains(geom.constGet()):
+                found.add(value)
+            elif was_split and engine.intersects(geom.constGet()):
+                # on a tile cut line: only the whole class geometry can tell
+                undecided.add(value)
+        for value in undecided - found:
+            if self.class_engine(value).contains(geom.constGet()):
+                found.add(value)
+        return found
+
+
+def count_points(points, classes, crs, context, feedback=None, max_vertices=TILE_MAX_VERTICES):
+    """
+    Counts the points falling inside each class geometry (native:countpointsinpolygon):
+    with Shapely and single points, one vectorized count per class over the
+    point coordinates (count_class); otherwise a ClassIndex over the tiled class
+    polygons, queried per point.
+
+    Returns a dict {class value: number of points}.
+    """
+    if rppt_core.shapely is not None and QgsWkbTypes.isSingleType(points.wkbType()):
+        coords = read_coordinates(points, crs, context, feedback)
+        counts = {}
+        for value, geom in classes.items():
+            if feedback is not None and feedback.isCanceled():
+                break
+            counts[value] = count_class(value, geom, None, None, coords=coords)
+        return counts
+
+    index = ClassIndex(classes, max_vertices)
+
+    request = QgsFeatureRequest().setNoAttributes()
+    request.setDestinationCrs(crs, context.transformContext())
+    total = 100.0 / points.featureCount() if points.featureCount() else 0
+
+    counts = {value: 0 for value in classes}
+    for current, feature in enumerate(points.getFeatures(request)):
+        if feedback is not None:
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(current * total)
+
+        geom = feature.geometry()
+        if geom.isEmpty():
+            continue
+        for value in index.containing(geom):
+            counts[value] += 1
+    return counts
+
+
+def read_coordinates(points, crs, context, feedback=None):
+    """(n, 2) array of the coordinates of a single point layer in crs, sorted by x (empty geometries skipped)."""
+    request = QgsFeatureRequest().setNoAttributes()
+    request.setDestinationCrs(crs, context.transformContext())
+    total = 100.0 / points.featureCount() if points.featureCount() else 0
+
+    xs, ys = [], []
+    for current, feature in enumerate(points.getFeatures(request)):
+        if feedback is not None:
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(current * total)
+        geom = feature.geometry()
+        if geom.isEmpty():
+            continue
+        point = geom.constGet()
+        xs.append(point.x())
+        ys.append(point.y())
+    coords = np.column_stack([np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)])
+    return coords[np.argsort(coords[:, 0], kind='stable')]
+
+
+def read_points(points, crs, context, feedback=None):
+    """
+    Reads the point geometries in crs and indexes them.
+
+    Returns (list of geometries, QgsSpatialIndex with the list positions as ids).
+    """
+    request = QgsFeatureRequest().setNoAttributes()
+    request.setDestinationCrs(crs, context.transformContext())
+    total = 100.0 / points.featureCount() if points.featureCount() else 0
+
+    geoms = []
+    index = QgsSpatialIndex()
+    for current, feature in enumerate(points.getFeatures(request)):
+        if feedback is not None:
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(current * total)
+        geom = feature.geometry()
+        if geom.isEmpty():
+            continue
+        index.addFeature(len(geoms), geom.boundingBox())
+        geoms.append(geom)
+    return geoms, index
+
+
+def point_coordinates(point_geoms):
+    """(n, 2) array of the point coordinates sorted by x, or None for multipoints or without Shapely."""
+    if rppt_core.shapely is None or any(geom.isMultipart() for geom in point_geoms):
+        return None
+    coords = np.empty((len(point_geoms), 2))
+    for i, geom in enumerate(point_geoms):
+        point = geom.constGet()
+        coords[i] = point.x(), point.y()
+    return coords[np.argsort(coords[:, 0], kind='stable')]
+
+
+def count_class(value, geom, point_geoms, point_index, max_vertices=TILE_MAX_VERTICES, coords=None):
+    """
+    Counts the points inside one class geometry. With coords (sorted by x, see
+    point_coordinates) the bounding box filter and the test run as vectorized
+    NumPy/Shapely calls (rppt_core.count_points_in), which release the GIL;
+    otherwise through a ClassIndex private to the caller, a Python loop per point.
+    """
+    if coords is not None:
+        box = geom.boundingBox()
+        start = np.searchsorted(coords[:, 0], box.xMinimum(), side='left')
+        end = np.searchsorted(coords[:, 0], box.xMaximum(), side='right')
+        candidates = coords[start:end]
+        candidates = candidates[(candidates[:, 1] >= box.yMinimum()) & (candidates[:, 1] <= box.yMaximum())]
+        return rppt_core.count_points_in(rppt_core.shapely.from_wkb(bytes(geom.asWkb())), candidates)
+    index = ClassIndex({value: geom}, max_vertices)
+    return sum(1 for i in point_index.intersects(geom.boundingBox())
+               if index.containing(point_geoms[i]))
+
+
+def parallel_overlay(pieces, area, point_geoms, point_index, workers, feedback=None, classes=None):
+    """
+    Dissolves (unless classes is given) and counts every class in a worker thread.
+    area is the study area geometry or its AreaTiles.
+    Geometries are deep-copied per task and each worker builds its own prepared
+    engines, since GEOS prepared geometries are not safe to share between threads.
+    The dissolve runs in GEOS; the counting only runs in parallel with Shapely
+    (see count_class), else it is bound by the GIL and the workers take turns.
+
+    pieces is the output of driver_pieces. Returns (classes, counts) in the order
+    of pieces (or classes).
+    """
+    def process(value, class_pieces, geom):
+        if geom is None:
+            clip_area = area.copy() if isinstance(area, AreaTiles) else QgsGeometry(area.constGet().clone())
+            geom = dissolve_pieces(class_pieces, clip_area)
+            if geom is None:
+                return value, None, 0
+        return value, geom, count_class(value, geom, point_geoms, point_index, coords=coords)
+
+    coords = point_coordinates(point_geoms)
+    if coords is None and feedback is not None:
+        feedback.pushInfo('Points counted without Shapely (or multipoints): the workers only parallelize the dissolve')
+    order = list(classes if classes is not None else pieces)
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process, value,
+                                   pieces.get(value, []) if pieces else [],
+                                   QgsGeometry(classes[value].constGet().clone()) if classes is not None else None)
+                   for value in order]
+        for done, future in enumerate(as_completed(futures)):
+            if feedback is not None:
+                if feedback.isCanceled():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                feedback.setProgress(100.0 * done / len(futures))
+            value, geom, count = future.result()
+            results[value] = (geom, count)
+
+    classes = {value: results[value][0] for value in order
+               if value in results and results[value][0] is not None}
+    counts = {value: results[value][1] for value in classes}
+    return classes, counts
+
+
+def appended_ids(points, last_fid, new_count):
+    """
+    Feature ids of the new_count points appended after last_fid. Append-only
+    layers number them last_fid + 1, ..., which the provider fetches by id;
+    only when ids were skipped are all the ids scanned.
+    """
+    if new_count <= 0:
+        return []
+    fids = list(range(int(last_fid) + 1, int(last_fid) + 1 + new_count))
+    request = QgsFeatureRequest().setFilterFids(fids).setNoAttributes()
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    found = [feature.id() for feature in points.getFeatures(request)]
+    if len(found) == new_count:
+        return found
+    return sorted(fid for fid in points.allFeatureIds() if fid > last_fid)
+
+
+def append_points(points, classes, area, counts, last_fid, new_count, crs, context, feedback=None):
+    """
+    Counts the new_count points appended after feature id last_fid against the
+    classes.
+
+    Returns (updated counts, last feature id, number of new points), or None as
+    soon as a new point falls outside the study area (area must be rebuilt).
+    """
+    counts = dict(counts)
+    fids = appended_ids(points, last_fid, new_count)
+    if not fids:
+        return counts, last_fid, 0
+    index = ClassIndex(classes)
+    area_engine = prepared_engine(area)
+    request = QgsFeatureRequest().setFilterFids(fids).setNoAttributes()
+    request.setDestinationCrs(crs, context.transformContext())
+    new_points = 0
+    for feature in points.getFeatures(request):
+        if feedback is not None and feedback.isCanceled():
+            break
+        last_fid = max(last_fid, feature.id())
+        new_points += 1
+        geom = feature.geometry()
+        if geom.isEmpty():
+            continue
+        if not area_engine.contains(geom.constGet()):
+            return None
+        for value in index.containing(geom):
+            counts[value] = counts.get(value, 0) + 1
+    return counts, last_fid, new_points
+
+
+def buffer_sweep(hull_layer, distances, driver, field_name, points, context, feedback=None, mode=AREA_CONTEXT,
+                 tiled=False, tolerance=0, stats=None):
+    """
+    Class areas and point counts for several buffer distances in one pass.
+
+    The study areas are nested, so the driver is clipped once by the largest one
+    and every class is split in rings (the area between consecutive buffers):
+    each point is counted in the innermost ring containing it and the values of
+    a distance are the cumulative sums of its rings. tiled, tolerance and stats
+    are passed to clip_and_dissolve.
+
+    Returns (sorted distances, classes clipped by the largest study area,
+    {class value: [area per distance]}, {class value: [count per distance]}).
+    """
+    distances = sorted(set(distances))
+    crs = driver.sourceCrs()
+    areas = [transformed(study_area(hull_layer, d), hull_layer.crs(), crs, context) for d in distances]
+    rings = [areas[0]] + [areas[i].difference(areas[i - 1]) for i in range(1, len(areas))]
+
+    feedback = steps(feedback, 3)
+    classes = clip_and_dissolve(driver, field_name, areas[-1], context, feedback, tiled, tolerance, stats)
+    if feedback is not None:
+        feedback.setCurrentStep(1)
+
+    ring_areas = {value: [] for value in classes}
+    for current, ring in enumerate(rings):
+        if feedback is not None:
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(100.0 * current / len(rings))
+        ring_classes = {value: geom.intersection(ring) for value, geom in classes.items()}
+        for value, area in class_areas(ring_classes, crs, context, mode).items():
+            ring_areas[value].append(area)
+
+    index = ClassIndex(classes)
+    area_engines = [prepared_engine(area) for area in areas]
+    ring_counts = {value: [0] * len(rings) for value in classes}
+    if feedback is not None:
+        feedback.setCurrentStep(2)
+
+    request = QgsFeatureRequest().setNoAttributes()
+    request.setDestinationCrs(crs, context.transformContext())
+    request.setFilterRect(areas[-1].boundingBox())
+    total = 100.0 / points.featureCount() if points.featureCount() else 0
+    for current, feature in enumerate(points.getFeatures(request)):
+        if feedback is not None:
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(current * total)
+        geom = feature.geometry()
+        if geom.isEmpty():
+            continue
+        found = index.containing(geom)
+        if not found:
+            continue
+        # nested areas: binary search for the innermost one containing the point
+        lo, hi = 0, len(areas) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if area_engines[mid].contains(geom.constGet()):
+                hi = mid
+            else:
+                lo = mid + 1
+        for value in found:
+            ring_counts[value][lo] += 1
+
+    cumulative_areas = {value: list(accumulate(a)) for value, a in ring_areas.items()}
+    cumulative_counts = {value: list(accumulate(c)) for value, c in ring_counts.items()}
+    return distances, classes, cumulative_areas, cumulative_counts
+
+
+def count_points_layer(points, polygons, context, feedback=None, max_vertices=TILE_MAX_VERTICES):
+    """
+    Indexed replacement of native:countpointsinpolygon: returns a memory layer
+    with the polygons and their NUMPOINTS field.
+    """
+    classes = {feature.id(): feature.geometry() for feature in polygons.getFeatures()
+               if not feature.geometry().isEmpty()}
+    counts = count_points(points, classes, polygons.crs(), context, feedback, max_vertices)
+
+    fields = QgsFields(polygons.fields())
+    fields.append(QgsField('NUMPOINTS', QVariant.Int))
+    layer = QgsMemoryProviderUtils.createMemoryLayer('CountPointsInPolygon', fields,
+                                                     polygons.wkbType(), polygons.crs())
+    features = []
+    for feature in polygons.getFeatures():
+        out = QgsFeature(fields)
+        out.setGeometry(feature.geometry())
+        out.setAttributes(feature.attributes() + [counts.get(feature.id(), 0)])
+        features.append(out)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def area_ellipsoid(context, mode=AREA_CONTEXT):
+    """Ellipsoid used for the class areas in mode ('NONE' for planar areas)."""
+    if mode == AREA_PLANAR:
+        return 'NONE'
+    ellipsoid = context.ellipsoid()
+    if mode == AREA_ELLIPSOIDAL and (not ellipsoid or ellipsoid == 'NONE'):
+        return DEFAULT_ELLIPSOID
+    return ellipsoid or 'NONE'
+
+
+def area_measure(crs, context, mode=AREA_CONTEXT):
+    """
+    Returns a function measuring a geometry area: like the field calculator
+    evaluates $area (AREA_CONTEXT), planar in crs (AREA_PLANAR) or on the
+    ellipsoid (AREA_ELLIPSOIDAL).
+    """
+    if mode == AREA_PLANAR:
+        return QgsGeometry.area
+    da = QgsDistanceArea()
+    da.setSourceCrs(crs, context.transformContext())
+    da.setEllipsoid(area_ellipsoid(context, mode))
+    unit = context.areaUnit()
+    return lambda geom: da.convertAreaMeasurement(da.measureArea(geom), unit)
+
+
+def class_areas(classes, crs, context, mode=AREA_CONTEXT):
+    """Measures every class geometry once (see area_measure for the modes)."""
+    measure = area_measure(crs, context, mode)
+    return {value: measure(geom) for value, geom in classes.items()}
+
+
+def grid_tiles(area, size, shape=TILES_SQUARE):
+    """
+    Square (side size) or flat-topped hexagonal (width size) tiles covering area,
+    clipped to it. Returns the list of tile geometries intersecting area.
+    """
+    bbox = area.boundingBox()
+    engine = prepared_engine(area)
+    cells = []
+    if shape == TILES_HEXAGON:
+        radius = size / 2
+        dx, dy = 1.5 * radius, math.sqrt(3) * radius
+        for i in range(int(math.ceil(bbox.width() / dx)) + 1):
+            cx = bbox.xMinimum() + i * dx
+            for j in range(int(math.ceil(bbox.height() / dy)) + 2):
+                cy = bbox.yMinimum() + j * dy - (dy / 2 if i % 2 else 0)
+                ring = [QgsPointXY(cx + radius * math.cos(k * math.pi / 3), cy + radius * math.sin(k * math.pi / 3))
+                        for k in range(6)]
+                cells.append(QgsGeometry.fromPolygonXY([ring + ring[:1]]))
+    else:
+        for i in range(int(math.ceil(bbox.width() / size)) or 1):
+            x = bbox.xMinimum() + i * size
+            for j in range(int(math.ceil(bbox.height() / size)) or 1):
+                y = bbox.yMinimum() + j * size
+                cells.append(QgsGeometry.fromRect(QgsRectangle(x, y, x + size, y + size)))
+
+    tiles = []
+    for cell in cells:
+        if not engine.intersects(cell.constGet()):
+            continue
+        if not engine.contains(cell.constGet()):
+            cell = cell.intersection(area)
+            cell.convertGeometryCollectionToSubclass(QgsWkbTypes.PolygonGeometry)
+            if cell.isEmpty():
+                continue
+        tiles.append(cell)
+    return tiles
+
+
+def tile_overlay(points, classes, tiles, crs, context, feedback=None, mode=AREA_CONTEXT):
+    """
+    Class areas and point counts per tile x class in one pass over the classes
+    and one over the points, joined through spatial indexes on the tiles and on
+    the (tiled) class polygons. A point on a tile edge goes to one tile only.
+
+    Returns ({(tile, class value): area}, {(tile, class value): count}).
+    """
+    tile_index = QgsSpatialIndex()
+    for i, tile in enumerate(tiles):
+        tile_index.addFeature(i, tile.boundingBox())
+    measure = area_measure(crs, context, mode)
+    feedback = steps(feedback, 2)
+
+    areas = {}
+    for current, (value, geom) in enumerate(classes.items()):
+        if feedback is not None:
+            if feedback.isCanceled():
+                return areas, {}
+            feedback.setProgress(100.0 * current / len(classes))
+        for part, _ in tiled_parts(geom):
+            for i in tile_index.intersects(part.boundingBox()):
+                piece = part.intersection(tiles[i])
+                if not piece.isEmpty():
+                    areas[(i, value)] = areas.get((i, value), 0.0) + measure(piece)
+
+    class_index = ClassIndex(classes)
+    tile_engines = {}
+    counts = {}
+    if feedback is not None:
+        feedback.setCurrentStep(1)
+    request = QgsFeatureRequest().setNoAttributes()
+    request.setDestinationCrs(crs, context.transformContext())
+    total = 100.0 / points.featureCount() if points.featureCount() else 0
+    for current, feature in enumerate(points.getFeatures(request)):
+        if feedback is not None:
+            if feedback.isCanceled():
+                break
+            feedback.setProgress(current * total)
+        geom = feature.geometry()
+        if geom.isEmpty():
+            continue
+        found = class_index.containing(geom)
+        if not found:
+            continue
+        for i in sorted(tile_index.intersects(geom.boundingBox())):
+            if i not in tile_engines:
+                tile_engines[i] = prepared_engine(tiles[i])
+            if tile_engines[i].intersects(geom.constGet()):
+                for value in found:
+                    counts[(i, value)] = counts.get((i, value), 0) + 1
+                break
+    return areas, counts
+
+
+def shares(values):
+    """{key: value over the exact total of all values} (rppt_core.shares); None when the total is 0."""
+    ratios = rppt_core.shares(list(values.values()))
+    return {key: None if math.isnan(ratio) else float(ratio) for key, ratio in zip(values, ratios)}
+
+
+def share_fields(fields):
+    """fields plus expected_vals and observed_vals, full double precision."""
+    fields = QgsFields(fields)
+    for name in ('expected_vals', 'observed_vals'):
+        if fields.lookupField(name) < 0:
+            fields.append(QgsField(name, QVariant.Double, 'double'))
+    return fields
+
+
+def systematized_fields(field_name):
+    """Fields of the systematized data layer, as produced by the processing chain."""
+    fields = QgsFields()
+    fields.append(QgsField(field_name, QVariant.String, 'text', 250))
+    fields.append(QgsField('NUMPOINTS', QVariant.Int))
+    return share_fields(fields)
+
+
+def systematized_features(classes, counts, areas, fields):
+    """
+    Builds the output features with expected_vals ($area/sum($area)) and
+    observed_vals ("NUMPOINTS"/sum("NUMPOINTS")).
+    """
+    expected = shares(areas)
+    observed = shares(counts)
+
+    features = []
+    for value, geom in classes.items():
+        feature = QgsFeature(fields)
+        geom = QgsGeometry(geom)
+        geom.convertToMultiType()
+        feature.setGeometry(geom)
+        feature.setAttributes([
+            None if value is None else str(value),
+            counts[value],
+            expected[value],
+            observed[value],
+        ])
+        features.append(feature)
+    return features
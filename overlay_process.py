@@ -1,8 +1,13 @@
+import hashlib
+import math
+import os
+import time
+
+import numpy as np
+
 from qgis.core import QgsProcessingUtils, QgsField
 from PyQt5.QtCore import QVariant
 from qgis.core import QgsExpression, QgsExpressionContext, QgsExpressionContextUtils
-from qgis.gui import QgsExpressionBuilderDialog #será usado depois
-from qgis.PyQt.QtWidgets import QInputDialog, QMessageBox  #será usado depois
 
 from qgis.PyQt.QtCore import QCoreApplication
 from qgis.core import (QgsProcessing,
@@ -12,19 +17,61 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterBoolean,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterFeatureSource,
+                       QgsProcessingFeatureSourceDefinition,
                        QgsProcessingParameterVectorLayer,
                        QgsProcessingMultiStepFeedback,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterField,
-                       QgsProcessingParameterFeatureSink)
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterFileDestination,
+                       QgsProcessingParameterString,
+                       QgsFeature,
+                       QgsFields,
+                       QgsGeometry,
+                       QgsCoordinateReferenceSystem,
+                       QgsWkbTypes)
 from qgis import processing
 
+import overlay_engine
+import incremental_state
+import prep_cache
+import rppt_core
+import run_checkpoint
+import stage_graph
+import stage_profiler
+
 class AleatorioProcessingAlgorithm(QgsProcessingAlgorithm):
 
     USE_CONCAVE = 'USE_CONCAVE'
     CONCAVE_PARAMETER = 'CONCAVE_PARAMETER'
     USE_MIN_BOUNDING = 'USE_MIN_BOUNDING'
     MIN_BOUNDING_TYPE = 'MIN_BOUNDING_TYPE'
+    USE_FUSED_ENGINE = 'USE_FUSED_ENGINE'
+    AREA_MODE = 'AREA_MODE'
+    BUFFER_SWEEP = 'BUFFER_SWEEP'
+    SWEEP_RESULTS = 'SWEEP_RESULTS'
+    INCREMENTAL_STATE = 'INCREMENTAL_STATE'
+    CONCAVE_DATA = 'CONCAVE_DATA'
+    INTERMEDIATES_IN_MEMORY = 'INTERMEDIATES_IN_MEMORY'
+    MEMORY_BUDGET = 'MEMORY_BUDGET'
+    LOCAL_TILES = 'LOCAL_TILES'
+    TILE_SIZE = 'TILE_SIZE'
+    LOCAL_ALPHA = 'LOCAL_ALPHA'
+    LOCAL_CORRECTION = 'LOCAL_CORRECTION'
+    TILE_RESULTS = 'TILE_RESULTS'
+    PROFILE_REPORT = 'PROFILE_REPORT'
+    PROFILE_TABLE = 'PROFILE_TABLE'
+    USE_INDEXED_COUNT = 'USE_INDEXED_COUNT'
+    CACHE_DIR = 'CACHE_DIR'
+    CACHE_MAX_SIZE = 'CACHE_MAX_SIZE'
+    RUN_DIR = 'RUN_DIR'
+    RESUME = 'RESUME'
+    WORKERS = 'WORKERS'
+    STREAM_HULL = 'STREAM_HULL'
+    PREPARE_DRIVER = 'PREPARE_DRIVER'
+    SIMPLIFY_TOLERANCE = 'SIMPLIFY_TOLERANCE'
+    HULL_CHUNK_SIZE = 'HULL_CHUNK_SIZE'
 
     def __init__(self):
         super(AleatorioProcessingAlgorithm, self).__init__()
@@ -66,263 +113,1030 @@ class AleatorioProcessingAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterFeatureSink('systematized_data', 
         'Systematized Data', type=QgsProcessing.TypeVectorAnyGeometry, createByDefault=True, 
         supportsAppend=True, defaultValue=None))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.CONCAVE_DATA,
+            'Systematized Data (Concave Hull, when both delimitations are used)',
+            type=QgsProcessing.TypeVectorAnyGeometry,
+            optional=True,
+            createByDefault=False))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.AREA_MODE,
+            'Area calculation for the expected values',
+            options=['Same as $area (project ellipsoid)', 'Planar (driver CRS)', 'Ellipsoidal'],
+            defaultValue=overlay_engine.AREA_CONTEXT,
+            optional=True))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.USE_FUSED_ENGINE,
+            'Use fused single-pass overlay engine (in memory)',
+            defaultValue=False))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.USE_INDEXED_COUNT,
+            'Count points with a spatial index over tiled polygons',
+            defaultValue=False))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.INTERMEDIATES_IN_MEMORY,
+            'Keep intermediate layers in memory',
+            defaultValue=False))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.MEMORY_BUDGET,
+            'Memory budget for intermediate layers (MB, spill to temporary files above it)',
+            type=QgsProcessingParameterNumber.Double,
+            minValue=0,
+            defaultValue=1024,
+            optional=True))
+        self.addParameter(QgsProcessingParameterFile(
+            self.CACHE_DIR,
+            'Preparation cache folder (reuse clipped/aggregated driver)',
+            behavior=QgsProcessingParameterFile.Folder,
+            optional=True))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.CACHE_MAX_SIZE,
+            'Preparation cache maximum size (MB)',
+            type=QgsProcessingParameterNumber.Double,
+            minValue=0,
+            defaultValue=prep_cache.DEFAULT_MAX_SIZE_MB,
+            optional=True))
+        self.addParameter(QgsProcessingParameterFile(
+            self.RUN_DIR,
+            'Run folder (checkpoint every completed stage)',
+            behavior=QgsProcessingParameterFile.Folder,
+            optional=True))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.RESUME,
+            'Resume from the checkpoints in the run folder',
+            defaultValue=False))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.WORKERS,
+            'Parallel workers for the fused engine (0 = all CPU cores)',
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=0,
+            defaultValue=1,
+            optional=True))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.PREPARE_DRIVER,
+            'Pre-filter the driver and clip it against a tiled study area',
+            defaultValue=False))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.SIMPLIFY_TOLERANCE,
+            'Driver simplification tolerance, topology-preserving (driver CRS units, 0 = none)',
+            type=QgsProcessingParameterNumber.Double,
+            minValue=0,
+            defaultValue=0,
+            optional=True))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.STREAM_HULL,
+            'Reduce the points in chunks before the hull (very large point layers)',
+            defaultValue=False))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.HULL_CHUNK_SIZE,
+            'Points per chunk for the reduced hull',
+            type=QgsProcessingParameterNumber.Integer,
+            minValue=1,
+            defaultValue=overlay_engine.HULL_CHUNK_SIZE,
+            optional=True))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.LOCAL_TILES,
+            'Local randomness test: chi-square per tile of the study area',
+            options=['None', 'Square grid', 'Hexagonal grid'],
+            defaultValue=overlay_engine.TILES_NONE,
+            optional=True))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.TILE_SIZE,
+            'Tile width (driver CRS units)',
+            type=QgsProcessingParameterNumber.Double,
+            minValue=0,
+            defaultValue=1000,
+            optional=True))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.LOCAL_ALPHA,
+            'Significance level of the local test',
+            type=QgsProcessingParameterNumber.Double,
+            minValue=0,
+            maxValue=1,
+            defaultValue=0.05,
+            optional=True))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.LOCAL_CORRECTION,
+            'Correction of the local residuals',
+            options=['Bonferroni (per tile)', 'FDR (Benjamini-Hochberg)'],
+            defaultValue=0,
+            optional=True))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.TILE_RESULTS,
+            'Local test per tile',
+            type=QgsProcessing.TypeVectorPolygon,
+            optional=True,
+            createByDefault=True))
+        self.addParameter(QgsProcessingParameterString(
+            self.BUFFER_SWEEP,
+            'Buffer sweep: widths of the study area to compare (e.g. 250, 500, 1000, 2000)',
+            optional=True))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.SWEEP_RESULTS,
+            'Buffer sweep results',
+            type=QgsProcessing.TypeVector,
+            optional=True,
+            createByDefault=True))
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.INCREMENTAL_STATE,
+            'Incremental state (count only the points appended since the last run)',
+            fileFilter='JSON files (*.json)',
+            optional=True,
+            createByDefault=False))
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.PROFILE_REPORT,
+            'Profiling report (per-stage time and memory, JSON)',
+            fileFilter='JSON files (*.json)',
+            optional=True,
+            createByDefault=False))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.PROFILE_TABLE,
+            'Profiling table',
+            type=QgsProcessing.TypeVector,
+            optional=True,
+            createByDefault=False))
 
     def processAlgorithm(self, parameters, context, model_feedback):
 
         use_concave = self.parameterAsBool(parameters, self.USE_CONCAVE, context)
         use_min_bounding = self.parameterAsBool(parameters, 'USE_MIN_BOUNDING', context)
 
-        # overall progress through the model
-        feedback = QgsProcessingMultiStepFeedback(6, model_feedback)
-        results = {}
-        outputs = {}
-
-        if use_concave:
-            # Implemente a lógica para Concave Hull
-            valor_ajuste = self.parameterAsDouble(parameters, self.CONCAVE_PARAMETER, context)
+        self.profiler = stage_profiler.StageProfiler(
+            enabled=bool(parameters.get(self.PROFILE_REPORT) or parameters.get(self.PROFILE_TABLE)))
+        self.hull_inputs = {}
+        self.memory_layers = {}
+        self.intermediates = {'memory': 0, 'disk': 0}
+        self.checkModes(parameters, context, use_concave, use_min_bounding)
 
-            # Use QgsExpressionBuilderDialog para obter o campo de agrupamento dinamicamente
-            field_aggreg = self.parameterAsString(parameters, 'field_aggreg', context)
+        if self.parameterAsString(parameters, self.BUFFER_SWEEP, context).strip():
+            results = self.processSweep(parameters, context, model_feedback, use_concave, use_min_bounding)
+        elif parameters.get(self.INCREMENTAL_STATE):
+            results = self.processIncremental(parameters, context, model_feedback, use_concave, use_min_bounding)
+        elif self.parameterAsEnum(parameters, self.LOCAL_TILES, context) != overlay_engine.TILES_NONE:
+            # the local test works on the classes and study area of the fused engine
+            state = {}
+            results = self.processFused(parameters, context, model_feedback, use_concave, use_min_bounding, state)
+            if results and not model_feedback.isCanceled():
+                results.update(self.processLocal(parameters, context, model_feedback, state))
+        elif self.parameterAsBool(parameters, self.USE_FUSED_ENGINE, context):
+            results = self.processFused(parameters, context, model_feedback, use_concave, use_min_bounding)
+        else:
+            results = self.processChain(parameters, context, model_feedback, use_concave, use_min_bounding)
 
-            #camada_driver_candidato = self.parameterAsVectorLayer(parameters, 'driver', context) #nova
-            if not field_aggreg:
-                QMessageBox.critical(None, "Erro", "Grouping field selection canceled")
-                return {}
+        if results and self.profiler.enabled:
+            results.update(self.writeProfile(parameters, context))
+        return results
 
-            # Concave hull
-            alg_params = {
-                'ALPHA': parameters[self.CONCAVE_PARAMETER],
-                'HOLES': True,
-                'INPUT': parameters['layer_to_analysis'],
-                'NO_MULTIGEOMETRY': False,
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-            }
-            outputs['ConcaveHull'] = processing.run('qgis:concavehull', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+    def checkModes(self, parameters, context, use_concave, use_min_bounding):
+        """Rejects the options the selected mode would ignore (sweep > incremental > local test > fused > chain)."""
+        sweep = bool(self.parameterAsString(parameters, self.BUFFER_SWEEP, context).strip())
+        incremental = bool(parameters.get(self.INCREMENTAL_STATE))
+        local = self.parameterAsEnum(parameters, self.LOCAL_TILES, context) != overlay_engine.TILES_NONE
+        fused = self.parameterAsBool(parameters, self.USE_FUSED_ENGINE, context)
+        options = {
+            'Incremental state': incremental,
+            'Local randomness test': local,
+            'Run folder': bool(self.parameterAsFile(parameters, self.RUN_DIR, context)),
+            'Use fused single-pass overlay engine': fused,
+            'Parallel workers': self.parameterAsInt(parameters, self.WORKERS, context) != 1,
+            'Preparation cache folder': bool(self.parameterAsFile(parameters, self.CACHE_DIR, context)),
+            'Keep intermediate layers in memory': self.parameterAsBool(parameters, self.INTERMEDIATES_IN_MEMORY, context),
+            'Count points with a spatial index': self.parameterAsBool(parameters, self.USE_INDEXED_COUNT, context),
+        }
+        chain_only = ['Keep intermediate layers in memory', 'Count points with a spatial index']
+        if sweep:
+            mode, ignored = 'Buffer sweep', list(options)
+        elif incremental:
+            mode, ignored = 'Incremental state', ['Local randomness test'] + chain_only
+        elif local:
+            mode, ignored = 'Local randomness test', chain_only
+        elif fused:
+            mode, ignored = 'Fused engine', chain_only
+        else:
+            mode, ignored = 'Processing chain', ['Parallel workers']
+        ignored = [name for name in ignored if options[name]]
+        if ignored:
+            raise QgsProcessingException(f"{mode} can't be combined with: {', '.join(ignored)}")
+        if use_concave and use_min_bounding and parameters.get(self.CONCAVE_DATA) and mode != 'Processing chain':
+            raise QgsProcessingException('Systematized Data (Concave Hull) is only written by the processing chain: '
+                                         'turn off the buffer sweep, incremental state, local test and fused engine '
+                                         'or select a single delimitation')
 
-            feedback.setCurrentStep(1)
-            if feedback.isCanceled():
-                return {}
+    def processChain(self, parameters, context, model_feedback, use_concave, use_min_bounding):
+        """
+        Part 1 as a graph of child algorithms (stage_graph): hull -> buffer ->
+        clip/aggregate -> count per delimitation, then the shares. Only the stages
+        needed by the requested outputs run, each once; with a cache folder their
+        outputs are kept and reused while the inputs are unchanged. With both
+        delimitations, systematized_data gets the Minimum Bounding Geometry result
+        and CONCAVE_DATA (when set) the Concave Hull one.
+        """
+        field_aggreg = self.parameterAsString(parameters, 'field_aggreg', context)
+        if not field_aggreg:
+            raise QgsProcessingException('Grouping field selection canceled')
 
-            # Buffer
-            alg_params = {
-                'DISSOLVE': True,
-                'DISTANCE': parameters['define_buffer'],
-                'END_CAP_STYLE': 0,  # Round
-                'INPUT': outputs['ConcaveHull']['OUTPUT'],
-                'JOIN_STYLE': 0,  # Round
-                'MITER_LIMIT': 2,
-                'SEGMENTS': 5,
-                'SEPARATE_DISJOINT': False,
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-            }
-            outputs['Buffer'] = processing.run('native:buffer', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        graph = self.stageGraph(parameters, context)
+        targets = []
+        if use_concave and (not use_min_bounding or parameters.get(self.CONCAVE_DATA)):
+            sink = self.CONCAVE_DATA if use_min_bounding else 'systematized_data'
+            targets.append((sink, self.declareChain(graph, parameters, context, True)))
+        elif use_concave:
+            model_feedback.pushInfo('Both delimitations selected: only the Minimum Bounding Geometry result is '
+                                    'kept (set the Concave Hull output to keep both)')
+        if use_min_bounding:
+            targets.append(('systematized_data', self.declareChain(graph, parameters, context, False)))
+        if not targets:
+            return {}
 
-            feedback.setCurrentStep(2)
+        # overall progress through the model: the stages to run plus the shares
+        feedback = QgsProcessingMultiStepFeedback(graph.pending([key for _, key in targets]) + len(targets), model_feedback)
+        count_outputs = []
+        for sink, key in targets:
+            count_outputs.append((sink, graph.output(key, feedback)))
             if feedback.isCanceled():
                 return {}
+        if graph.reused:
+            feedback.pushInfo(f"Unchanged stages reused: {', '.join(graph.reused)}")
+        if self.parameterAsBool(parameters, self.INTERMEDIATES_IN_MEMORY, context):
+            feedback.pushInfo(f"Intermediate outputs: {self.intermediates['memory']} in memory, "
+                              f"{self.intermediates['disk']} spilled to temporary files")
 
-            # Clip (clip drive layer by point layer buffer) Concave hull
-            alg_params = {
-                'INPUT': parameters['driver'],
-                'OVERLAY': outputs['Buffer']['OUTPUT'],
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-            }
-            outputs['driver_clipped'] = processing.run('native:clip', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-            feedback.setCurrentStep(3)
+        results = {}
+        for sink, count_output in count_outputs:
+            # Expected and observed values (class areas measured once)
+            with self.profiler.stage('SystematizedShares') as stage:
+                shares = self.writeShares(parameters, context, feedback, count_output, sink)
+            stage['input_features'] = stage['output_features'] = shares['count']
+            results[sink] = shares['OUTPUT']
+            graph.done += 1
+            feedback.setCurrentStep(graph.done)
             if feedback.isCanceled():
                 return {}
+        graph.evict()
+        return results
 
-            # aggregation algorithm
-            alg_params = {
-                'AGGREGATES': [{'aggregate': 'concatenate_unique', 'delimiter': ',', 'input': f'"{field_aggreg}"', 'length': 250,
-                                'name': field_aggreg, 'precision': 0, 'sub_type': 0, 'type': 10, 'type_name': 'text'}],
-                'GROUP_BY': f'"{field_aggreg}"',
-                'INPUT': outputs['driver_clipped']['OUTPUT'],
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-            }
-            outputs['Aggregate'] = processing.run('native:aggregate', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-     
-            feedback.setCurrentStep(4)
-            if feedback.isCanceled():
-                return {}
+    def stageGraph(self, parameters, context):
+        """
+        Stage graph storing its outputs in RUN_DIR/stages when a run folder is set
+        (emptied first unless resuming, never evicted), else in CACHE_DIR/stages
+        when a cache folder is set.
+        """
+        run_dir = self.parameterAsFile(parameters, self.RUN_DIR, context)
+        directory = run_dir or self.parameterAsFile(parameters, self.CACHE_DIR, context)
+        max_size = self.parameterAsDouble(parameters, self.CACHE_MAX_SIZE, context) or stage_graph.DEFAULT_MAX_SIZE_MB
+        if run_dir:
+            max_size = None
+        graph = stage_graph.StageGraph(os.path.join(directory, 'stages') if directory else None, max_size,
+                                       release=lambda output: self.releaseIntermediate(output, context))
+        if run_dir and not self.parameterAsBool(parameters, self.RESUME, context):
+            graph.clear()
+        return graph
 
-            # Count points in polygon
-            alg_params = {
-                'CLASSFIELD': '',
-                'FIELD': 'NUMPOINTS',
-                'POINTS': parameters['layer_to_analysis'],
-                'POLYGONS': outputs['Aggregate']['OUTPUT'],
-                'WEIGHT': '',
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-            }
-            outputs['CountPointsInPolygon'] = processing.run('native:countpointsinpolygon', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+    def graphSource(self, graph, parameters, name, context):
+        """Declares an input layer of the graph, fingerprinted by its file when it has one."""
+        value = parameters[name]
+        layer = self.parameterAsVectorLayer(parameters, name, context)
+        if layer is None or self.sourceSubset(parameters, name, context):
+            return graph.source(value)
+        return graph.source(value, layer.source())
 
-            feedback.setCurrentStep(5)
-            if feedback.isCanceled():
-                return {}
+    def sourceSubset(self, parameters, name, context):
+        """
+        Describes the part of the input layer used when it isn't the whole layer
+        (selected features, feature filter or limit): '' for the whole layer.
+        """
+        value = parameters.get(name)
+        if not isinstance(value, QgsProcessingFeatureSourceDefinition):
+            return ''
+        subset = []
+        if value.selectedFeaturesOnly:
+            layer = self.parameterAsVectorLayer(parameters, name, context)
+            ids = sorted(layer.selectedFeatureIds()) if layer is not None else []
+            subset.append('selected:' + hashlib.sha256(repr(ids).encode('utf-8')).hexdigest())
+        if getattr(value, 'featureLimit', -1) > 0:
+            subset.append(f'limit:{value.featureLimit}')
+        if getattr(value, 'filterExpression', ''):
+            subset.append(f'filter:{value.filterExpression}')
+        return '|'.join(subset)
 
-            # Field calculator: expected values
-            alg_params = {
-                'FIELD_LENGTH': 3,
-                'FIELD_NAME': 'expected_vals',
-                'FIELD_PRECISION': 3,
-                'FIELD_TYPE': 0,
-                'FORMULA': '($area/sum($area))',
-                'INPUT': outputs['CountPointsInPolygon']['OUTPUT'],
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-            }
-            outputs['FieldCalculatorAreaporc'] = processing.run('native:fieldcalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+    def declareChain(self, graph, parameters, context, use_concave):
+        """Declares hull -> buffer -> clip/aggregate -> count for one delimitation; returns the count stage."""
+        field_aggreg = self.parameterAsString(parameters, 'field_aggreg', context)
+        points = self.graphSource(graph, parameters, 'layer_to_analysis', context)
+        driver = self.graphSource(graph, parameters, 'driver', context)
+        tiled, tolerance = self.driverPreparation(parameters, context)
 
-            feedback.setCurrentStep(6)
-            if feedback.isCanceled():
-                return {}
+        hull_input = points
+        if self.parameterAsBool(parameters, self.STREAM_HULL, context):
+            hull_input = graph.add(
+                'HullCandidates', lambda inputs, destination, feedback: self.hullInput(parameters, context, feedback, use_concave),
+                [points], {'concave': use_concave,
+                           'buffer': self.parameterAsDouble(parameters, 'define_buffer', context),
+                           'chunk': self.parameterAsInt(parameters, self.HULL_CHUNK_SIZE, context)},
+                persist=False)
 
-            # Field calculator (observed values)
-            alg_params = {
-                'FIELD_LENGTH': 3,
-                'FIELD_NAME': 'observed_vals',
-                'FIELD_PRECISION': 3,
-                'FIELD_TYPE': 0,
-                'FORMULA': '"NUMPOINTS"/sum("NUMPOINTS")',
-                'INPUT': outputs['FieldCalculatorAreaporc']['OUTPUT'],
-                'OUTPUT': parameters['systematized_data']
-            }
-            outputs['FieldCalculatorObservado'] = processing.run('native:fieldcalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-            results['systematized_data'] = outputs['FieldCalculatorObservado']['OUTPUT']
-                        
-        if use_min_bounding:
-            min_bounding_type = self.parameterAsEnum(parameters, self.MIN_BOUNDING_TYPE, context)
-            bounding_output = None
-
-            # Use QgsExpressionBuilderDialog to get grouping field dynamically
-            field_aggreg = self.parameterAsString(parameters, 'field_aggreg', context)
-            #camada_driver_candidato = self.parameterAsVectorLayer(parameters, 'driver', context) #nova
-            if not field_aggreg:
-                QMessageBox.critical(None, "Erro", "Grouping field selection canceled")
-                return {}
+        def hull(inputs, destination, feedback):
+            alg_id, alg_params = self.hullAlgorithm(parameters, context, use_concave, inputs[0], destination)
+            return self.runChild('ConcaveHull' if use_concave else 'MinimumBoundingGeometry',
+                                 alg_id, alg_params, context, feedback)['OUTPUT']
+        if use_concave:
+            hull_params = {'alpha': self.parameterAsDouble(parameters, self.CONCAVE_PARAMETER, context)}
+        else:
+            hull_params = {'type': self.parameterAsEnum(parameters, self.MIN_BOUNDING_TYPE, context)}
+        hull_key = graph.add('ConcaveHull' if use_concave else 'MinimumBoundingGeometry', hull, [hull_input], hull_params)
 
-            if min_bounding_type == 0:  # 'Envelope (Bounding Box)'
-                # Envelope Logic
-                alg_params = {
-                    'INPUT': parameters['layer_to_analysis'],
-                    'TYPE': 0,  # Envelope
-                    'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-                }
-                bounding_output = processing.run('qgis:minimumboundinggeometry', alg_params, context=context, feedback=model_feedback, is_child_algorithm=True)['OUTPUT']
-
-            elif min_bounding_type == 1:  # 'Minimal Oriented Rectangle'
-                # Logic for Minimal Oriented Rectangle
-                alg_params = {
-                    'INPUT': parameters['layer_to_analysis'],
-                    'TYPE': 1,  # Minimal Oriented Rectangle
-                    'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-                }
-                bounding_output = processing.run('qgis:minimumboundinggeometry', alg_params, context=context, feedback=model_feedback, is_child_algorithm=True)['OUTPUT']
-
-            elif min_bounding_type == 2:  # 'Minimal Closed Circle'
-                # Logic for Minimal Closed Circle
-                alg_params = {
-                    'INPUT': parameters['layer_to_analysis'],
-                    'TYPE': 2,  # Minimal Closed Circle
-                    'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-                }
-                bounding_output = processing.run('qgis:minimumboundinggeometry', alg_params, context=context, feedback=model_feedback, is_child_algorithm=True)['OUTPUT']
-
-            feedback.setCurrentStep(1)
-            if feedback.isCanceled():
-                return {}
-                
-            # Buffer
+        def buffer(inputs, destination, feedback):
             alg_params = {
                 'DISSOLVE': True,
                 'DISTANCE': parameters['define_buffer'],
                 'END_CAP_STYLE': 0,  # Round
-                'INPUT': bounding_output,  # Uses the output of the process MIN_BOUNDING
+                'INPUT': inputs[0],
                 'JOIN_STYLE': 0,  # Round
                 'MITER_LIMIT': 2,
                 'SEGMENTS': 5,
                 'SEPARATE_DISJOINT': False,
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-            }
-            outputs['Buffer'] = processing.run('native:buffer', alg_params, context=context, feedback=model_feedback, is_child_algorithm=True)
-
-            feedback.setCurrentStep(2)
-            if feedback.isCanceled():
-                return {}
-
-            # Clip (clip drive layer by point layer buffer)
-            alg_params = {
-                'INPUT': parameters['driver'],
-                'OVERLAY': outputs['Buffer']['OUTPUT'],
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
+                'OUTPUT': destination or self.intermediateOutput(parameters, context)
             }
-            outputs['driver_clipped'] = processing.run('native:clip', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            return self.runChild('Buffer', 'native:buffer', alg_params, context, feedback)['OUTPUT']
+        buffer_key = graph.add('Buffer', buffer, [hull_key],
+                               {'distance': self.parameterAsDouble(parameters, 'define_buffer', context)})
 
-            feedback.setCurrentStep(3)
-            if feedback.isCanceled():
-                return {}
-
-            # aggregation algorithm
+        def clip_aggregate(inputs, destination, feedback):
+            # reused from the preparation cache when possible
+            cache, cache_key = self.preparationCache(parameters, context, inputs[0], field_aggreg)
+            cached = cache.get(cache_key) if cache_key else None
+            if cached:
+                return cached[0]
+            clipped = self.clipDriver(parameters, context, feedback, inputs[0])['OUTPUT']
             alg_params = {
                 'AGGREGATES': [{'aggregate': 'concatenate_unique', 'delimiter': ',', 'input': f'"{field_aggreg}"', 'length': 250,
                                 'name': field_aggreg, 'precision': 0, 'sub_type': 0, 'type': 10, 'type_name': 'text'}],
                 'GROUP_BY': f'"{field_aggreg}"',
-                'INPUT': outputs['driver_clipped']['OUTPUT'],
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
+                'INPUT': clipped,
+                'OUTPUT': destination or self.intermediateOutput(parameters, context)
             }
-            outputs['Aggregate'] = processing.run('native:aggregate', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-     
-            feedback.setCurrentStep(4)
-            if feedback.isCanceled():
-                return {}
+            output = self.runChild('Aggregate', 'native:aggregate', alg_params, context, feedback)['OUTPUT']
+            self.releaseIntermediate(clipped, context)
+            if cache_key and not feedback.isCanceled():
+                self.storePreparation(parameters, cache, cache_key, output, context)
+            return output
+        aggregate_key = graph.add('Aggregate', clip_aggregate, [buffer_key, driver],
+                                  {'field': field_aggreg, 'tiled': tiled, 'tolerance': tolerance})
 
-            # Count points in polygon
+        def count(inputs, destination, feedback):
+            if self.parameterAsBool(parameters, self.USE_INDEXED_COUNT, context):
+                with self.profiler.stage('CountPointsIndexed') as stage:
+                    output = self.countPointsIndexed(parameters, context, feedback, inputs[0])['OUTPUT']
+                self.profileLayers(stage, context, [parameters['layer_to_analysis'], inputs[0]], output)
+                return output
             alg_params = {
                 'CLASSFIELD': '',
                 'FIELD': 'NUMPOINTS',
                 'POINTS': parameters['layer_to_analysis'],
-                'POLYGONS': outputs['Aggregate']['OUTPUT'],
+                'POLYGONS': inputs[0],
                 'WEIGHT': '',
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
+                'OUTPUT': destination or self.intermediateOutput(parameters, context)
             }
-            outputs['CountPointsInPolygon'] = processing.run('native:countpointsinpolygon', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            return self.runChild('CountPointsInPolygon', 'native:countpointsinpolygon', alg_params, context, feedback)['OUTPUT']
+        # the indexed count gives the same NUMPOINTS, so it shares the fingerprint
+        return graph.add('CountPointsInPolygon', count, [aggregate_key, points])
+
+    def writeShares(self, parameters, context, feedback, count_output, sink_name='systematized_data'):
+        """
+        Replaces the two field calculators ($area/sum($area) and "NUMPOINTS"/sum("NUMPOINTS")):
+        measures every class area once in the chosen area mode and writes expected_vals
+        and observed_vals together, in full double precision, to the sink_name sink.
+        """
+        layer = QgsProcessingUtils.mapLayerFromString(count_output, context)
+        classes = {feature.id(): feature.geometry() for feature in layer.getFeatures()}
+        counts = {feature.id(): feature['NUMPOINTS'] or 0 for feature in layer.getFeatures()}
+        areas = overlay_engine.class_areas(classes, layer.crs(), context, self.parameterAsEnum(parameters, self.AREA_MODE, context))
+        expected, observed = overlay_engine.shares(areas), overlay_engine.shares(counts)
 
-            feedback.setCurrentStep(5)
+        fields = overlay_engine.share_fields(layer.fields())
+        (sink, dest_id) = self.parameterAsSink(parameters, sink_name, context,
+                                               fields, layer.wkbType(), layer.crs())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, sink_name))
+        idx_expected, idx_observed = fields.lookupField('expected_vals'), fields.lookupField('observed_vals')
+        for feature in layer.getFeatures():
             if feedback.isCanceled():
-                return {}
+                break
+            out = QgsFeature(fields)
+            out.setGeometry(feature.geometry())
+            attrs = feature.attributes() + [None] * (fields.count() - len(feature.attributes()))
+            attrs[idx_expected] = expected[feature.id()]
+            attrs[idx_observed] = observed[feature.id()]
+            out.setAttributes(attrs)
+            sink.addFeature(out, QgsFeatureSink.FastInsert)
+        return {'OUTPUT': dest_id, 'count': len(classes)}
 
-            # Field calculator: expected values
+    def clipDriver(self, parameters, context, feedback, buffer_output):
+        """
+        native:clip of the driver by the buffer, or with PREPARE_DRIVER or a
+        simplification tolerance the in-memory clip of overlay_engine.clip_layer.
+        """
+        tiled, tolerance = self.driverPreparation(parameters, context)
+        if not (tiled or tolerance):
             alg_params = {
-                'FIELD_LENGTH': 3,
-                'FIELD_NAME': 'expected_vals',
-                'FIELD_PRECISION': 3,
-                'FIELD_TYPE': 0,  # Decimal (double)
-                'FORMULA': '($area/sum($area))',
-                'INPUT': outputs['CountPointsInPolygon']['OUTPUT'],
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
+                'INPUT': parameters['driver'],
+                'OVERLAY': buffer_output,
+                'OUTPUT': self.intermediateOutput(parameters, context)
             }
-            outputs['FieldCalculatorAreaporc'] = processing.run('native:fieldcalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            return self.runChild('driver_clipped', 'native:clip', alg_params, context, feedback)
 
-            feedback.setCurrentStep(6)
-            if feedback.isCanceled():
-                return {}
+        driver = self.parameterAsSource(parameters, 'driver', context)
+        buffer_layer = QgsProcessingUtils.mapLayerFromString(buffer_output, context)
+        area = overlay_engine.transformed(overlay_engine.layer_geometry(buffer_layer), buffer_layer.crs(),
+                                          driver.sourceCrs(), context)
+        stats = overlay_engine.simplify_stats()
+        with self.profiler.stage('driver_clipped') as stage:
+            layer = overlay_engine.clip_layer(driver, area, feedback, tiled, tolerance, stats)
+        if self.profiler.enabled:
+            stage['input_features'], stage['input_vertices'] = overlay_engine.feature_stats(driver)
+            stage['output_features'], stage['output_vertices'] = overlay_engine.feature_stats(layer)
+        if tolerance:
+            feedback.pushInfo(overlay_engine.simplify_report(stats, tolerance))
+        context.temporaryLayerStore().addMapLayer(layer)
+        self.trackIntermediate(layer.id(), context)
+        return {'OUTPUT': layer.id()}
 
-            # Field calculator (observed values)
-            alg_params = {
-                'FIELD_LENGTH': 3,
-                'FIELD_NAME': 'observed_vals',
-                'FIELD_PRECISION': 3,
-                'FIELD_TYPE': 0,
-                'FORMULA': '"NUMPOINTS"/sum("NUMPOINTS")',
-                'INPUT': outputs['FieldCalculatorAreaporc']['OUTPUT'],
-                'OUTPUT': parameters['systematized_data']
+    def driverPreparation(self, parameters, context):
+        """Returns (tiled clip, simplification tolerance)."""
+        return (self.parameterAsBool(parameters, self.PREPARE_DRIVER, context),
+                self.parameterAsDouble(parameters, self.SIMPLIFY_TOLERANCE, context))
+
+    def runChild(self, name, alg_id, alg_params, context, feedback):
+        """processing.run of a Part 1 stage, profiled when profiling is enabled."""
+        with self.profiler.stage(name) as stage:
+            output = processing.run(alg_id, alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        if alg_params.get('OUTPUT') == 'memory:':
+            self.trackIntermediate(output['OUTPUT'], context)
+        if self.profiler.enabled:
+            inputs = [alg_params[key] for key in ('INPUT', 'OVERLAY', 'POINTS', 'POLYGONS') if key in alg_params]
+            self.profileLayers(stage, context, inputs, output['OUTPUT'])
+        return output
+
+    def intermediateOutput(self, parameters, context):
+        """
+        Destination of an intermediate child output: with INTERMEDIATES_IN_MEMORY a
+        memory layer, handed to the next stage by id without being written, while
+        the memory layers held stay under MEMORY_BUDGET; otherwise (or above the
+        budget) the usual temporary file.
+        """
+        if not self.parameterAsBool(parameters, self.INTERMEDIATES_IN_MEMORY, context):
+            return QgsProcessing.TEMPORARY_OUTPUT
+        budget = self.parameterAsDouble(parameters, self.MEMORY_BUDGET, context) * 1024 * 1024
+        if sum(self.memory_layers.values()) < budget:
+            self.intermediates['memory'] += 1
+            return 'memory:'
+        self.intermediates['disk'] += 1
+        return QgsProcessing.TEMPORARY_OUTPUT
+
+    def trackIntermediate(self, output, context):
+        """Counts a memory layer output against the memory budget."""
+        layer = context.temporaryLayerStore().mapLayer(output) if isinstance(output, str) else None
+        if layer is not None and layer.providerType() == 'memory':
+            self.memory_layers[output] = overlay_engine.layer_bytes(layer)
+
+    def releaseIntermediate(self, output, context):
+        """Frees a memory layer output no stage needs any more."""
+        if output in self.memory_layers:
+            del self.memory_layers[output]
+            context.temporaryLayerStore().removeMapLayer(output)
+
+    def profileLayers(self, stage, context, inputs, output):
+        """Fills the feature and vertex counts of a stage record from its input and output layers."""
+        if not self.profiler.enabled:
+            return
+        stage['input_features'] = stage['input_vertices'] = 0
+        for source in inputs:
+            if isinstance(source, str):
+                layer = QgsProcessingUtils.mapLayerFromString(source, context)
+            else:
+                layer = QgsProcessingUtils.variantToSource(source, context)
+            if layer is None:
+                continue
+            features, vertices = overlay_engine.feature_stats(layer)
+            stage['input_features'] += features
+            stage['input_vertices'] += vertices
+        layer = QgsProcessingUtils.mapLayerFromString(output, context)
+        if layer is not None:
+            stage['output_features'], stage['output_vertices'] = overlay_engine.feature_stats(layer)
+
+    def writeProfile(self, parameters, context):
+        """Writes the profiling report (JSON) and/or table; returns their outputs."""
+        results = {}
+        report_path = self.parameterAsFileOutput(parameters, self.PROFILE_REPORT, context)
+        if report_path:
+            self.profiler.write_json(report_path)
+            results[self.PROFILE_REPORT] = report_path
+
+        if parameters.get(self.PROFILE_TABLE):
+            fields = QgsFields()
+            fields.append(QgsField('stage', QVariant.String))
+            for key in stage_profiler.STAGE_KEYS[1:]:
+                fields.append(QgsField(key, QVariant.Double))
+            (sink, dest_id) = self.parameterAsSink(parameters, self.PROFILE_TABLE, context, fields,
+                                                   QgsWkbTypes.NoGeometry, QgsCoordinateReferenceSystem())
+            if sink is None:
+                raise QgsProcessingException(self.invalidSinkError(parameters, self.PROFILE_TABLE))
+            for record in self.profiler.stages:
+                feature = QgsFeature(fields)
+                feature.setAttributes([record[key] for key in stage_profiler.STAGE_KEYS])
+                sink.addFeature(feature, QgsFeatureSink.FastInsert)
+            results[self.PROFILE_TABLE] = dest_id
+        return results
+
+    def hullInput(self, parameters, context, feedback, use_concave):
+        """
+        Input of the hull algorithms: the point layer, or with STREAM_HULL the
+        candidates kept by overlay_engine.hull_candidates (read once per run).
+        For the concave hull the grid cell is the smallest buffer width (of the
+        sweep, or define_buffer) / (2 * sqrt(2)), so every dropped point stays
+        inside each buffered study area; without a positive width the concave
+        hull gets all the points.
+        """
+        if not self.parameterAsBool(parameters, self.STREAM_HULL, context):
+            return parameters['layer_to_analysis']
+        if use_concave in self.hull_inputs:
+            return self.hull_inputs[use_concave]
+
+        if self.parameterAsString(parameters, self.BUFFER_SWEEP, context).strip():
+            distance = min(self.sweepDistances(parameters, context))
+        else:
+            distance = self.parameterAsDouble(parameters, 'define_buffer', context)
+        if use_concave and distance <= 0:
+            feedback.pushInfo('Hull input not reduced: the concave hull needs a buffer width greater than 0')
+            return parameters['layer_to_analysis']
+
+        points = self.parameterAsSource(parameters, 'layer_to_analysis', context)
+        chunk_size = self.parameterAsInt(parameters, self.HULL_CHUNK_SIZE, context) or overlay_engine.HULL_CHUNK_SIZE
+        # only the concave hull thins the points on the grid
+        cell_size = distance / (2 * math.sqrt(2)) if use_concave else 0
+
+        with self.profiler.stage('HullCandidates') as stage:
+            start = time.perf_counter()
+            candidates, read = overlay_engine.hull_candidates(points, use_concave, cell_size, chunk_size, feedback)
+            layer = overlay_engine.points_layer(candidates, points.sourceCrs())
+            elapsed = time.perf_counter() - start
+        stage['input_features'] = read
+        stage['output_features'] = stage['output_vertices'] = len(candidates)
+        peak = stage_profiler.peak_rss_mb()
+        feedback.pushInfo(f'Hull input reduced from {read} to {len(candidates)} points '
+                          f'({100 * len(candidates) / max(read, 1):.2f}%) in {elapsed:.1f} s, chunks of {chunk_size}'
+                          + (f', peak memory {peak:.0f} MB' if peak else ''))
+
+        context.temporaryLayerStore().addMapLayer(layer)
+        self.hull_inputs[use_concave] = layer.id()
+        return layer.id()
+
+    def hullAlgorithm(self, parameters, context, use_concave, hull_input, destination=None):
+        """Returns (algorithm id, parameters) of the concave hull or the minimum bounding geometry."""
+        if use_concave:
+            return 'qgis:concavehull', {
+                'ALPHA': parameters[self.CONCAVE_PARAMETER],
+                'HOLES': True,
+                'INPUT': hull_input,
+                'NO_MULTIGEOMETRY': False,
+                'OUTPUT': destination or self.intermediateOutput(parameters, context)
             }
-            outputs['FieldCalculatorObservado'] = processing.run('native:fieldcalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-            results['systematized_data'] = outputs['FieldCalculatorObservado']['OUTPUT']
-  
+        return 'qgis:minimumboundinggeometry', {
+            'INPUT': hull_input,
+            'TYPE': self.parameterAsEnum(parameters, self.MIN_BOUNDING_TYPE, context),
+            'OUTPUT': destination or self.intermediateOutput(parameters, context)
+        }
+
+    def studyAreaHull(self, parameters, context, feedback, use_concave):
+        """
+        Runs the concave hull or the minimum bounding geometry on the points
+        and returns the resulting layer.
+        """
+        alg_id, alg_params = self.hullAlgorithm(parameters, context, use_concave,
+                                                self.hullInput(parameters, context, feedback, use_concave))
+        output = self.runChild('StudyAreaHull', alg_id, alg_params, context, feedback)['OUTPUT']
+        return QgsProcessingUtils.mapLayerFromString(output, context)
+
+    def preparationCache(self, parameters, context, buffer_output, field_aggreg):
+        """
+        Returns (cache, key) for the study area in buffer_output, or (None, None)
+        when no cache folder is set or the driver can't be cached.
+        """
+        if not self.parameterAsFile(parameters, self.CACHE_DIR, context):
+            return None, None
+        buffer_layer = QgsProcessingUtils.mapLayerFromString(buffer_output, context)
+        return self.preparationCacheForArea(parameters, context, overlay_engine.layer_geometry(buffer_layer),
+                                            buffer_layer.crs(), field_aggreg)
+
+    def preparationCacheForArea(self, parameters, context, area, area_crs, field_aggreg):
+        directory = self.parameterAsFile(parameters, self.CACHE_DIR, context)
+        driver = self.parameterAsVectorLayer(parameters, 'driver', context)
+        if not directory or driver is None or self.sourceSubset(parameters, 'driver', context):
+            # a selection or filtered subset would share the entry of the whole layer
+            return None, None
+        cache = prep_cache.PreparationCache(directory, self.parameterAsDouble(parameters, self.CACHE_MAX_SIZE, context))
+        area = overlay_engine.transformed(area, area_crs, driver.crs(), context)
+        distance = self.parameterAsDouble(parameters, 'define_buffer', context)
+        ellipsoid = overlay_engine.area_ellipsoid(context, self.parameterAsEnum(parameters, self.AREA_MODE, context))
+        tolerance = self.parameterAsDouble(parameters, self.SIMPLIFY_TOLERANCE, context)
+        return cache, cache.key(driver, field_aggreg, area, distance, ellipsoid, tolerance)
+
+    def storePreparation(self, parameters, cache, cache_key, aggregate_output, context):
+        """Stores the aggregated driver and its per-class areas in the preparation cache."""
+        layer = QgsProcessingUtils.mapLayerFromString(aggregate_output, context)
+        classes = {feature.id(): feature.geometry() for feature in layer.getFeatures()}
+        areas = overlay_engine.class_areas(classes, layer.crs(), context, self.parameterAsEnum(parameters, self.AREA_MODE, context))
+        cache.put(cache_key, layer, areas.values(), context)
+
+    def countPointsIndexed(self, parameters, context, feedback, polygons_output):
+        """
+        Counts the points per polygon with overlay_engine.ClassIndex instead of
+        native:countpointsinpolygon; returns the output like processing.run does.
+        """
+        points = self.parameterAsSource(parameters, 'layer_to_analysis', context)
+        polygons = QgsProcessingUtils.mapLayerFromString(polygons_output, context)
+        layer = overlay_engine.count_points_layer(points, polygons, context, feedback)
+        context.temporaryLayerStore().addMapLayer(layer)
+        self.trackIntermediate(layer.id(), context)
+        return {'OUTPUT': layer.id()}
+
+    def processFused(self, parameters, context, model_feedback, use_concave, use_min_bounding, state=None):
+        """
+        Same result as the processing chain, but the study area is computed once and
+        clip, aggregate, count and both field calculators run in memory: only the
+        systematized_data sink is written. A state dict receives the study area,
+        classes, counts and areas.
+        """
+        if not (use_concave or use_min_bounding):
+            return {}
+
+        field_aggreg = self.parameterAsString(parameters, 'field_aggreg', context)
+        if not field_aggreg:
+            raise QgsProcessingException('Grouping field selection canceled')
+        if use_concave and use_min_bounding:
+            # the chain runs both branches and keeps the minimum bounding output
+            model_feedback.pushInfo('Both delimitations selected: only the Minimum Bounding Geometry result is kept')
+
+        points = self.parameterAsSource(parameters, 'layer_to_analysis', context)
+        driver = self.parameterAsSource(parameters, 'driver', context)
+        distance = self.parameterAsDouble(parameters, 'define_buffer', context)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context) or os.cpu_count() or 1
+        area_mode = self.parameterAsEnum(parameters, self.AREA_MODE, context)
+        tiled, tolerance = self.driverPreparation(parameters, context)
+        stats = overlay_engine.simplify_stats()
+
+        feedback = QgsProcessingMultiStepFeedback(4, model_feedback)
+        checkpoints = self.runCheckpoints(parameters, context, use_concave, use_min_bounding, tiled)
+
+        profiler = self.profiler
+        saved = checkpoints.load('StudyArea') if checkpoints else None
+        if saved:
+            area = run_checkpoint.hex_geometry(saved)
+            cache, cache_key = self.preparationCacheForArea(parameters, context, area, driver.sourceCrs(), field_aggreg)
+            feedback.pushInfo('Study area resumed from the run folder')
+        else:
+            hull = self.studyAreaHull(parameters, context, feedback, use_concave and not use_min_bounding)
+            with profiler.stage('StudyArea') as stage:
+                area = overlay_engine.study_area(hull, distance)
+                cache, cache_key = self.preparationCacheForArea(parameters, context, area, hull.crs(), field_aggreg)
+                area = overlay_engine.transformed(area, hull.crs(), driver.sourceCrs(), context)
+            if profiler.enabled:
+                stage['input_features'], stage['input_vertices'] = overlay_engine.feature_stats(hull)
+                stage['output_features'], stage['output_vertices'] = overlay_engine.geometry_stats([area])
+            if checkpoints and not feedback.isCanceled():
+                checkpoints.save('StudyArea', run_checkpoint.geometry_hex(area))
+
+        feedback.setCurrentStep(1)
+        if feedback.isCanceled():
+            return {}
+
+        cached = cache.get(cache_key) if cache_key else None
+        counted = checkpoints.load_classes('CountPoints') if checkpoints else None
+        clipped = None if counted or cached or not checkpoints else checkpoints.load_classes('ClipAggregate')
+        pieces = None
+        with profiler.stage('ClipAggregate') as stage:
+            if counted:
+                classes = counted[0]
+                if cached:
+                    areas = dict(zip(classes, cached[1]))
+                feedback.pushInfo('Clipped classes and point counts resumed from the run folder')
+            elif clipped:
+                classes = clipped[0]
+                feedback.pushInfo('Clipped and aggregated driver resumed from the run folder')
+            elif cached:
+                uri, cached_areas = cached
+                classes = overlay_engine.layer_classes(prep_cache.PreparationCache.load(uri), field_aggreg)
+                areas = dict(zip(classes, cached_areas))
+                feedback.pushInfo('Clipped and aggregated driver reused from the preparation cache')
+            elif workers > 1:
+                # clipping and dissolving run per class in the workers, with the counting
+                pieces = overlay_engine.driver_pieces(driver, field_aggreg, area, feedback, tolerance, stats)
+                classes = None
+            else:
+                classes = overlay_engine.clip_and_dissolve(driver, field_aggreg, area, context, feedback,
+                                                           tiled, tolerance, stats)
+                if checkpoints and not feedback.isCanceled():
+                    checkpoints.save_classes('ClipAggregate', classes)
+        if profiler.enabled:
+            stage['input_features'], stage['input_vertices'] = overlay_engine.feature_stats(driver)
+            if classes is not None:
+                stage['output_features'], stage['output_vertices'] = overlay_engine.geometry_stats(classes.values())
+        if tolerance and not (cached or counted or clipped):
+            feedback.pushInfo(overlay_engine.simplify_report(stats, tolerance))
+
+        feedback.setCurrentStep(2)
+        if feedback.isCanceled():
+            return {}
+
+        with profiler.stage('CountPoints') as stage:
+            if counted:
+                counts = counted[1]['counts']
+            elif workers > 1:
+                point_geoms, point_index = overlay_engine.read_points(points, driver.sourceCrs(), context, feedback)
+                clip_area = overlay_engine.AreaTiles(area) if tiled else area
+                classes, counts = overlay_engine.parallel_overlay(pieces, clip_area, point_geoms, point_index,
+                                                                  workers, feedback, classes)
+            else:
+                counts = overlay_engine.count_points(points, classes, driver.sourceCrs(), context, feedback)
+            if checkpoints and not counted and not feedback.isCanceled():
+                checkpoints.save_classes('CountPoints', classes, counts=counts)
+        if profiler.enabled:
+            stage['input_features'], stage['input_vertices'] = overlay_engine.feature_stats(points)
+            stage['output_features'] = len(counts)
+
+        with profiler.stage('ClassAreas') as stage:
+            if not cached:
+                areas = overlay_engine.class_areas(classes, driver.sourceCrs(), context, area_mode)
+                if cache_key and not feedback.isCanceled():
+                    layer = overlay_engine.classes_layer(classes, field_aggreg, driver.sourceCrs())
+                    cache.put(cache_key, layer, areas.values(), context)
+        stage['input_features'] = stage['output_features'] = len(classes)
+
+        feedback.setCurrentStep(3)
+        if feedback.isCanceled():
+            return {}
+
+        with profiler.stage('WriteSystematized') as stage:
+            dest_id = self.writeSystematized(parameters, context, field_aggreg, driver.sourceCrs(),
+                                             classes, counts, areas)
+        stage['input_features'] = stage['output_features'] = len(classes)
+
+        if state is not None:
+            state.update(area=area, classes=classes, counts=counts, areas=areas)
+        feedback.setCurrentStep(4)
+        return {'systematized_data': dest_id}
+
+    def runCheckpoints(self, parameters, context, use_concave, use_min_bounding, tiled):
+        """Checkpoints of the fused engine in RUN_DIR, keyed by the input layers and settings; None without a run folder."""
+        run_dir = self.parameterAsFile(parameters, self.RUN_DIR, context)
+        if not run_dir:
+            return None
+        sources = []
+        for name in ('layer_to_analysis', 'driver'):
+            layer = self.parameterAsVectorLayer(parameters, name, context)
+            sources.append(layer.source() if layer is not None else str(parameters[name]))
+        area_mode = self.parameterAsEnum(parameters, self.AREA_MODE, context)
+        settings = [use_concave, self.parameterAsDouble(parameters, self.CONCAVE_PARAMETER, context),
+                    use_min_bounding, self.parameterAsEnum(parameters, self.MIN_BOUNDING_TYPE, context),
+                    self.parameterAsDouble(parameters, 'define_buffer', context),
+                    self.parameterAsString(parameters, 'field_aggreg', context),
+                    area_mode, overlay_engine.area_ellipsoid(context, area_mode),
+                    self.parameterAsBool(parameters, self.STREAM_HULL, context),
+                    tiled, self.parameterAsDouble(parameters, self.SIMPLIFY_TOLERANCE, context),
+                    self.sourceSubset(parameters, 'layer_to_analysis', context),
+                    self.sourceSubset(parameters, 'driver', context)]
+        return run_checkpoint.RunCheckpoints(run_dir, run_checkpoint.run_key(sources, settings),
+                                             self.parameterAsBool(parameters, self.RESUME, context))
+
+    def writeSystematized(self, parameters, context, field_aggreg, crs, classes, counts, areas):
+        """Writes the in-memory overlay result to the systematized_data sink."""
+        fields = overlay_engine.systematized_fields(field_aggreg)
+        (sink, dest_id) = self.parameterAsSink(parameters, 'systematized_data', context,
+                                               fields, QgsWkbTypes.MultiPolygon, crs)
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, 'systematized_data'))
+        for feature in overlay_engine.systematized_features(classes, counts, areas, fields):
+            sink.addFeature(feature, QgsFeatureSink.FastInsert)
+        return dest_id
+
+    def processIncremental(self, parameters, context, model_feedback, use_concave, use_min_bounding):
+        """
+        Incremental run for append-only point layers. With a saved state for the
+        same inputs only the points appended since the last run are counted; the
+        hull, buffer and clip are rebuilt (fused engine) when there is no state,
+        points were removed or a new point falls outside the saved study area.
+        """
+        if not (use_concave or use_min_bounding):
+            return {}
+        field_aggreg = self.parameterAsString(parameters, 'field_aggreg', context)
+        if not field_aggreg:
+            raise QgsProcessingException('Grouping field selection canceled')
+        points_layer = self.parameterAsVectorLayer(parameters, 'layer_to_analysis', context)
+        driver = self.parameterAsVectorLayer(parameters, 'driver', context)
+        if points_layer is None or driver is None:
+            raise QgsProcessingException('Incremental mode needs the points and the driver as layers')
+        # same features (selection) as the rebuild in processFused
+        points = self.parameterAsSource(parameters, 'layer_to_analysis', context)
+
+        area_mode = self.parameterAsEnum(parameters, self.AREA_MODE, context)
+        settings = [use_concave, self.parameterAsDouble(parameters, self.CONCAVE_PARAMETER, context),
+                    use_min_bounding, self.parameterAsEnum(parameters, self.MIN_BOUNDING_TYPE, context),
+                    self.parameterAsDouble(parameters, 'define_buffer', context),
+                    area_mode, overlay_engine.area_ellipsoid(context, area_mode),
+                    self.parameterAsDouble(parameters, self.SIMPLIFY_TOLERANCE, context),
+                    self.sourceSubset(parameters, 'layer_to_analysis', context),
+                    self.sourceSubset(parameters, 'driver', context)]
+        state_file = incremental_state.IncrementalState(
+            self.parameterAsFileOutput(parameters, self.INCREMENTAL_STATE, context))
+        key = state_file.key(points_layer, driver, field_aggreg, settings)
+        state = state_file.load(key)
+
+        update = None
+        if state is not None and points.featureCount() < state['num_points']:
+            model_feedback.pushInfo('Points were removed since the last run: rebuilding the study area')
+        elif state is not None:
+            with self.profiler.stage('AppendPoints') as stage:
+                update = overlay_engine.append_points(points, state['classes'], state['area'], state['counts'],
+                                                      state['last_fid'], points.featureCount() - state['num_points'],
+                                                      driver.crs(), context, model_feedback)
+            stage['output_features'] = len(state['classes'])
+            if update is None:
+                model_feedback.pushInfo('New points outside the study area: rebuilding it')
+
+        if update is not None:
+            counts, last_fid, new_points = update
+            model_feedback.pushInfo(f'{new_points} new points counted in the saved study area')
+            state['counts'] = counts
+            results = {'systematized_data': self.writeSystematized(
+                parameters, context, field_aggreg, driver.crs(), state['classes'], counts, state['areas'])}
+        else:
+            state = {}
+            results = self.processFused(parameters, context, model_feedback, use_concave, use_min_bounding, state)
+            last_fid = max(points.allFeatureIds(), default=-1)
+
+        if results and not model_feedback.isCanceled():
+            state_file.save(key, last_fid, points.featureCount(), state['area'], state['classes'],
+                            state['counts'], state['areas'])
         return results
 
+    def processLocal(self, parameters, context, feedback, state):
+        """
+        Local randomness test: the study area in state is split into square or
+        hexagonal tiles, the class areas and points are counted per tile x class
+        and every tile is tested at once (rppt_core.local_test). Writes one
+        polygon per tile to TILE_RESULTS.
+        """
+        size = self.parameterAsDouble(parameters, self.TILE_SIZE, context)
+        if size <= 0:
+            raise QgsProcessingException('Local randomness test: the tile width must be greater than 0')
+        shape = self.parameterAsEnum(parameters, self.LOCAL_TILES, context)
+        alpha = self.parameterAsDouble(parameters, self.LOCAL_ALPHA, context)
+        use_fdr = self.parameterAsEnum(parameters, self.LOCAL_CORRECTION, context) == 1
+        points = self.parameterAsSource(parameters, 'layer_to_analysis', context)
+        crs = self.parameterAsSource(parameters, 'driver', context).sourceCrs()
+        area_mode = self.parameterAsEnum(parameters, self.AREA_MODE, context)
+
+        with self.profiler.stage('LocalTiles') as stage:
+            tiles = overlay_engine.grid_tiles(state['area'], size, shape)
+            areas, counts = overlay_engine.tile_overlay(points, state['classes'], tiles, crs, context, feedback, area_mode)
+        stage['output_features'] = len(tiles)
+        if feedback.isCanceled():
+            return {}
+
+        keys = [key for key, area in areas.items() if area > 0]
+        tile_codes = {}
+        groups = np.fromiter((tile_codes.setdefault(tile, len(tile_codes)) for tile, _ in keys), dtype=int, count=len(keys))
+        expected = np.array([areas[key] for key in keys], dtype=float)
+        observed = np.array([counts.get(key, 0) for key in keys], dtype=float)
+        group_stats, class_stats = rppt_core.local_test(groups, expected, observed, alpha)
+        exceeds = class_stats['exceeds_fdr'] if use_fdr else class_stats['exceeds_bonferroni']
+
+        rows = [[] for _ in tile_codes]
+        for i, g in enumerate(groups):
+            rows[g].append(i)
+
+        fields = QgsFields()
+        fields.append(QgsField('tile_id', QVariant.Int))
+        fields.append(QgsField('num_classes', QVariant.Int))
+        fields.append(QgsField('num_points', QVariant.Int))
+        for name in ('chi2', 'p_value', 'bonferroni_p_value', 'fdr_p_value', 'max_abs_residual'):
+            fields.append(QgsField(name, QVariant.Double))
+        fields.append(QgsField('exceeding', QVariant.Int))
+        fields.append(QgsField('exceeding_classes', QVariant.String, 'text', 250))
+        (sink, dest_id) = self.parameterAsSink(parameters, self.TILE_RESULTS, context, fields,
+                                               QgsWkbTypes.MultiPolygon, crs)
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.TILE_RESULTS))
+
+        def number(value):
+            return None if np.isnan(value) else float(value)
+
+        for tile, g in tile_codes.items():
+            if feedback.isCanceled():
+                break
+            tested = bool(group_stats['tested'][g])
+            residuals = class_stats['residual'][rows[g]]
+            labels = [str(keys[i][1]) for i in rows[g] if exceeds[i]]
+            geom = QgsGeometry(tiles[tile])
+            geom.convertToMultiType()
+            feature = QgsFeature(fields)
+            feature.setGeometry(geom)
+            feature.setAttributes([
+                tile, int(group_stats['num_tests'][g]), int(group_stats['points'][g]),
+                number(group_stats['chi2'][g]), number(group_stats['p_value'][g]),
+                number(group_stats['bonferroni_p_value'][g]), number(group_stats['fdr_p_value'][g]),
+                float(np.abs(residuals).max()) if tested else None,
+                len(labels), ','.join(labels)[:250],
+            ])
+            sink.addFeature(feature, QgsFeatureSink.FastInsert)
+
+        rejected = int((group_stats['fdr_p_value'][group_stats['tested']] < alpha).sum())
+        feedback.pushInfo(f"Local chi-square goodness-of-fit Test: {int(group_stats['tested'].sum())} of "
+                          f"{len(tile_codes)} tiles tested, null hypothesis rejected in {rejected} "
+                          f"(alpha {alpha:.3f}, FDR over the tiles).")
+        return {self.TILE_RESULTS: dest_id}
+
+    def sweepDistances(self, parameters, context):
+        """Widths of BUFFER_SWEEP; raises QgsProcessingException unless they are one or more numbers >= 0."""
+        text = self.parameterAsString(parameters, self.BUFFER_SWEEP, context)
+        try:
+            distances = [float(d) for d in text.replace(';', ',').split(',') if d.strip()]
+        except ValueError:
+            raise QgsProcessingException('Buffer sweep: use a comma separated list of widths, e.g. 250, 500, 1000')
+        if not distances:
+            raise QgsProcessingException('Buffer sweep: no width given')
+        if min(distances) < 0:
+            raise QgsProcessingException('Buffer sweep: the widths must be 0 or greater')
+        return distances
+
+    def processSweep(self, parameters, context, model_feedback, use_concave, use_min_bounding):
+        """
+        Buffer sweep: chi-square and p-value of the Part 2 test for every width in
+        BUFFER_SWEEP, from one hull and one clip (see overlay_engine.buffer_sweep).
+        systematized_data receives the classes of the largest width.
+        """
+        if not (use_concave or use_min_bounding):
+            return {}
+        field_aggreg = self.parameterAsString(parameters, 'field_aggreg', context)
+        if not field_aggreg:
+            raise QgsProcessingException('Grouping field selection canceled')
+        distances = self.sweepDistances(parameters, context)
+
+        points = self.parameterAsSource(parameters, 'layer_to_analysis', context)
+        driver = self.parameterAsSource(parameters, 'driver', context)
+        area_mode = self.parameterAsEnum(parameters, self.AREA_MODE, context)
+
+        feedback = QgsProcessingMultiStepFeedback(3, model_feedback)
+        hull = self.studyAreaHull(parameters, context, feedback, use_concave and not use_min_bounding)
+
+        feedback.setCurrentStep(1)
+        if feedback.isCanceled():
+            return {}
+
+        tiled, tolerance = self.driverPreparation(parameters, context)
+        stats = overlay_engine.simplify_stats()
+        with self.profiler.stage('BufferSweep') as stage:
+            distances, classes, areas, counts = overlay_engine.buffer_sweep(
+                hull, distances, driver, field_aggreg, points, context, feedback, area_mode,
+                tiled, tolerance, stats)
+        stage['output_features'] = len(distances)
+        if tolerance:
+            feedback.pushInfo(overlay_engine.simplify_report(stats, tolerance))
+
+        feedback.setCurrentStep(2)
+        if feedback.isCanceled():
+            return {}
+
+        fields = QgsFields()
+        fields.append(QgsField('distance', QVariant.Double))
+        fields.append(QgsField('num_classes', QVariant.Int))
+        fields.append(QgsField('num_points', QVariant.Int))
+        for name in ('chi2', 'p_value', 'bonferroni_p_value'):
+            fields.append(QgsField(name, QVariant.Double))
+        (sink, sweep_id) = self.parameterAsSink(parameters, self.SWEEP_RESULTS, context, fields,
+                                                QgsWkbTypes.NoGeometry, QgsCoordinateReferenceSystem())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.SWEEP_RESULTS))
+
+        for i, distance in enumerate(distances):
+            present = [value for value in classes if areas[value][i] > 0]
+            expected = [areas[value][i] for value in present]
+            observed = [counts[value][i] for value in present]
+            chi2, p_value, _ = rppt_core.chi_square_test(expected, observed)
+            bonferroni_p_value, _ = rppt_core.bonferroni(p_value, len(present), 0)
+            feature = QgsFeature(fields)
+            feature.setAttributes([distance, len(present), int(sum(observed)), chi2, p_value, bonferroni_p_value])
+            sink.addFeature(feature, QgsFeatureSink.FastInsert)
+            feedback.pushInfo(f'Buffer {distance:g}: {len(present)} themes, Chi-Square {chi2:.4f}, p-value {p_value:.6f}')
+
+        last_areas = {value: a[-1] for value, a in areas.items()}
+        last_counts = {value: c[-1] for value, c in counts.items()}
+        dest_id = self.writeSystematized(parameters, context, field_aggreg, driver.sourceCrs(),
+                                         classes, last_counts, last_areas)
+
+        feedback.setCurrentStep(3)
+        return {'systematized_data': dest_id, self.SWEEP_RESULTS: sweep_id}
+
     def name(self):
         return 'Spatial_Randomness_Test_p1'
 
@@ -365,6 +1179,20 @@ class AleatorioProcessingAlgorithm(QgsProcessingAlgorithm):
             \n <b>Driver - layer (Polygon) \
             \n >     Vector layer containing the theme to be analyzed, for example: Geology, LULC - Land Use and Land Cover, etc: type polygon\
             \n >>> Defines the width of the study area around the points: is a buffer that represent the influence area around points\
+            \n >>> Buffer sweep: a list of widths (e.g. 250, 500, 1000) computes the hull and the clip once and adds up the areas and points of the rings between consecutive widths; Buffer sweep results has the Chi-Square and p-value for every width and Systematized Data the classes of the largest width\
+            \n >>> Incremental state: a JSON file keeping the study area, classes and counts between runs; for point layers that only receive new features, the next run counts just the appended points and rebuilds the study area only when one of them falls outside it\
+            \n >>> Pre-filter the driver: driver polygons are selected by bounding box through the spatial index, the ones fully inside the study area are kept whole and the rest are clipped against a tiled study area; with a simplification tolerance, the selected polygons are first simplified (topology-preserving, per polygon) and the vertex and area changes are reported in the log\
+            \n >>> Reduce the points in chunks before the hull: for very large point layers, the points are streamed and only the convex hull vertices (plus, for the Concave Hull, one point per grid cell of the smallest buffer width / 2.83) reach the hull algorithm; the envelope, oriented rectangle and enclosing circle are unchanged and every point stays inside the buffered study area. With a width of 0 the Concave Hull gets all the points\
+            \n >>> Local randomness test: splits the study area into square or hexagonal tiles of the given width, counts points and class areas per tile and class in one pass and runs the Chi-Square test for every tile at once (same statistics as Part 2). Local test per tile has chi2, p-value, Bonferroni and FDR (over the tiles) corrected p-values and the classes whose residual exceeds the Bonferroni or FDR critical value; tiles with fewer than two classes or no points are not tested. Uses the fused engine\
+            \n >>> Area calculation: the class areas are measured once, as $area does (project ellipsoid), planar in the driver CRS or ellipsoidal (project ellipsoid, WGS84 when none is set); expected_vals and observed_vals are written together in full double precision\
+            \n >>> Count points with a spatial index: replaces Count Points in Polygon by an R-tree over the aggregated polygons split into small tiles with prepared geometries (the fused engine always counts this way)\
+            \n >>> Preparation cache folder: stores the clipped and aggregated driver (GeoPackage) with its class areas, so later runs with the same driver, field, study area and buffer skip straight to point counting. Without the fused engine, the hull, buffer, aggregate and count outputs are also kept (subfolder stages) and reused while the input files and settings are unchanged. The least recently used entries of earlier runs are removed beyond the maximum size\
+            \n >>> Systematized Data (Concave Hull): when both delimitations are selected, Systematized Data gets the Minimum Bounding Geometry result; set this output to also get the Concave Hull one in the same run (only the extra hull, buffer, clip and count are run). Without it, the Concave Hull stages are skipped. Only the processing chain writes it: with the fused engine, buffer sweep, incremental state or local test, select a single delimitation. Options the selected mode would ignore are rejected: the buffer sweep runs with none of the incremental state, local test, run folder, fused engine, parallel workers, preparation cache, intermediates in memory or indexed count; the incremental state not with the local test; the incremental state, local test and fused engine not with the intermediates in memory or indexed count (they always count in memory, indexed); the processing chain not with parallel workers\
+            \n >>> Use fused single-pass overlay engine: computes the study area once and runs clip, aggregate and point counting in memory, writing only the Systematized Data (same result, much faster on large driver layers)\
+            \n >>> Keep intermediate layers in memory: the hull, buffer, clip, aggregate and count outputs are memory layers passed from stage to stage without being written and re-read; above the memory budget the next outputs go to temporary files again, and layers no stage needs are freed\
+            \n >>> Run folder / Resume: every completed stage is checkpointed in the run folder (fused engine: study area, clipped classes and counts; chain: the hull, buffer, aggregate and count outputs), stamped with the input files and settings. Progress moves per class, ring and tile and a cancel stops within the running stage; with Resume, a canceled or interrupted run continues from the last completed stage, without it the run folder is emptied first. The run folder has no size limit\
+            \n >>> Profiling report / table: records wall time, CPU time, memory (RSS and peak RSS), bytes read and written and the input/output feature and vertex counts of every stage (hull, buffer, clip, aggregate, count, shares)\
+            \n >>> Parallel workers: with the fused engine, each class of the driver is clipped, dissolved and counted in its own worker thread (0 uses all CPU cores)\
             \n \
             \n \
             \n contact: \
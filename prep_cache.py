@@ -0,0 +1,120 @@
+"""
+On-disk cache of the clipped and aggregated driver for Spatial Randomness Part 1.
+
+Each entry is a GeoPackage with the aggregated driver (same schema as the
+native:aggregate output) and a JSON sidecar with the per-class areas, keyed by
+the driver source and modification time, the aggregation field, the study area
+geometry, the buffer distance, the ellipsoid used for the areas and the driver
+simplification tolerance.
+"""
+import hashlib
+import json
+import os
+
+from qgis.core import (QgsFeature,
+                       QgsFeatureSink,
+                       QgsVectorFileWriter,
+                       QgsVectorLayer,
+                       QgsWkbTypes)
+
+DEFAULT_MAX_SIZE_MB = 1024
+LAYER_NAME = 'aggregated'
+
+
+class PreparationCache:
+    """Keyed cache directory with least-recently-used eviction."""
+
+    def __init__(self, directory, max_size_mb=DEFAULT_MAX_SIZE_MB):
+        self.directory = directory
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(driver_layer, field_name, area, distance, ellipsoid, tolerance=0):
+        """
+        Returns the cache key, or None when the driver is not a file (memory
+        layers, databases) and its modification time can't be checked.
+        tolerance is the driver simplification tolerance (0 = none).
+        """
+        path = driver_layer.source().split('|')[0]
+        if not os.path.isfile(path):
+            return None
+        digest = hashlib.sha256()
+        for part in (driver_layer.source(), repr(os.path.getmtime(path)), field_name,
+                     repr(float(distance)), ellipsoid or ''):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        if tolerance:
+            digest.update(repr(float(tolerance)).encode('utf-8'))
+        digest.update(bytes(area.asWkb()))
+        return digest.hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.gpkg', base + '.json'
+
+    def uri(self, key):
+        return f'{self._paths(key)[0]}|layername={LAYER_NAME}'
+
+    def get(self, key):
+        """Returns (layer uri, per-class areas in feature order), or None on a miss."""
+        gpkg, sidecar = self._paths(key)
+        if not (os.path.isfile(gpkg) and os.path.isfile(sidecar)):
+            return None
+        with open(sidecar, encoding='utf-8') as f:
+            areas = json.load(f)['areas']
+        os.utime(sidecar)  # recently used
+        return self.uri(key), areas
+
+    def put(self, key, layer, areas, context):
+        """Stores the aggregated layer and its per-class areas, then evicts old entries."""
+        gpkg, sidecar = self._paths(key)
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = 'GPKG'
+        options.layerName = LAYER_NAME
+        writer = QgsVectorFileWriter.create(gpkg, layer.fields(), QgsWkbTypes.multiType(layer.wkbType()),
+                                            layer.crs(), context.transformContext(), options)
+        if writer.hasError() != QgsVectorFileWriter.NoError:
+            return None
+        for feature in layer.getFeatures():
+            out = QgsFeature(feature)
+            geom = out.geometry()
+            geom.convertToMultiType()
+            out.setGeometry(geom)
+            writer.addFeature(out, QgsFeatureSink.FastInsert)
+        del writer
+
+        with open(sidecar, 'w', encoding='utf-8') as f:
+            json.dump({'areas': list(areas)}, f)
+        self.evict()
+        return self.uri(key)
+
+    def entries(self):
+        """Returns [(last use, size in bytes, key)] of the stored entries."""
+        entries = []
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if ext != '.json':
+                continue
+            gpkg, sidecar = self._paths(key)
+            if not os.path.isfile(gpkg):
+                continue
+            size = os.path.getsize(gpkg) + os.path.getsize(sidecar)
+            entries.append((os.path.getmtime(sidecar), size, key))
+        return entries
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_bytes."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size
+
+    @staticmethod
+    def load(uri):
+        return QgsVectorLayer(uri, LAYER_NAME, 'ogr')
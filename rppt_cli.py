@@ -0,0 +1,222 @@
+"""
+Headless entry point for the Randomness Point Pattern Test (RPPT).
+
+Runs Part 1 (overlay process and data preparation) and Part 2 (Chi-square
+goodness-of-fit Test) end to end on files, without the QGIS GUI, and writes
+the results as JSON and/or CSV:
+
+    python rppt_cli.py points.gpkg driver.gpkg CLASS --buffer 1000 --concave 0.3
+        --output systematized.gpkg --json results.json --csv classes.csv
+
+or from Python:
+
+    from rppt_cli import run_rppt
+    results = run_rppt('points.gpkg', 'driver.gpkg', 'CLASS', buffer=1000)
+
+QGIS is only imported (and initialized once, headless) when a run starts.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+BOUNDING_TYPES = ['envelope', 'oriented-rectangle', 'circle']
+
+_qgs = None
+
+
+def start_qgis():
+    """Initializes QGIS and Processing without GUI (once per process)."""
+    global _qgs
+    if _qgs is not None:
+        return _qgs
+    from qgis.core import QgsApplication
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    _qgs = QgsApplication([], False)
+    _qgs.initQgis()
+    # the Processing plugin (and qgis.processing) lives in the QGIS plugins folder
+    plugins = os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins')
+    if plugins not in sys.path:
+        sys.path.append(plugins)
+    from processing.core.Processing import Processing
+    Processing.initialize()
+    return _qgs
+
+
+def make_feedback(verbose=False):
+    """Processing feedback collecting the messages (echoed to stderr when verbose)."""
+    from qgis.core import QgsProcessingFeedback
+
+    class Feedback(QgsProcessingFeedback):
+        def __init__(self):
+            super().__init__()
+            self.messages = []
+
+        def pushInfo(self, info):
+            self.messages.append(info)
+            if verbose:
+                print(info, file=sys.stderr)
+
+        def reportError(self, error, fatalError=False):
+            self.messages.append(error)
+            print(error, file=sys.stderr)
+
+    return Feedback()
+
+
+def class_rows(systematized, field_aggreg, alpha):
+    """Per-class expected/observed shares, residuals and exceedances of the systematized data."""
+    import numpy as np
+    from qgis.core import QgsVectorLayer
+    from chisquare_bf import TesteAleatoriedadeProcessingAlgorithm as Part2
+
+    layer = QgsVectorLayer(systematized, 'systematized_data', 'ogr')
+    label, expected, observed, _ = Part2.read_values(layer, field_aggreg, 'expected_vals', 'observed_vals')
+    _, class_stats = Part2.grouped_test(np.zeros(len(label), dtype=int), expected, observed, alpha)
+    rows = []
+    for i, lb in enumerate(label):
+        rows.append({
+            'label': None if lb is None else str(lb),
+            'expected': float(class_stats['expected'][i]),
+            'observed': float(class_stats['observed'][i]),
+            'residual': float(class_stats['residual'][i]),
+            'exceeds_alpha': bool(class_stats['exceeds_alpha'][i]),
+            'exceeds_bonferroni': bool(class_stats['exceeds_bonferroni'][i]),
+        })
+    return rows
+
+
+def run_rppt(points, driver, field_aggreg, buffer=1000, concave=None, bounding_type=None,
+             output=None, alpha=0.05, fused=False, workers=1, sweep=None, state=None,
+             run_dir=None, resume=False, part1_options=None, part2_options=None, verbose=False):
+    """
+    Runs Part 1 and Part 2 and returns a dict with the Part 1 output, the Part 2
+    statistics and the per-class residuals.
+
+    Use concave (0-1) for the Concave Hull delimitation or bounding_type (one of
+    BOUNDING_TYPES) for the Minimum Bounding Geometry; the envelope is used when
+    neither is given. sweep (list of widths) adds the buffer sweep table, one row
+    per width; Part 2 then runs on the largest one. state (JSON file) turns on the
+    incremental mode for point layers that only receive new features. run_dir
+    (folder) checkpoints every completed Part 1 stage; with resume, an interrupted
+    run continues from the last one. Extra algorithm parameters go
+    in part1_options/part2_options.
+    """
+    start_qgis()
+    from qgis import processing
+    from overlay_process import AleatorioProcessingAlgorithm as Part1
+    from chisquare_bf import TesteAleatoriedadeProcessingAlgorithm as Part2
+
+    if concave is None and bounding_type is None:
+        bounding_type = BOUNDING_TYPES[0]
+    output = output or os.path.abspath('systematized_data.gpkg')
+    feedback = make_feedback(verbose)
+
+    params = {
+        'layer_to_analysis': points,
+        Part1.USE_CONCAVE: concave is not None,
+        Part1.CONCAVE_PARAMETER: concave if concave is not None else 0.3,
+        Part1.USE_MIN_BOUNDING: bounding_type is not None,
+        Part1.MIN_BOUNDING_TYPE: BOUNDING_TYPES.index(bounding_type) if bounding_type is not None else 0,
+        'define_buffer': buffer,
+        'driver': driver,
+        'field_aggreg': field_aggreg,
+        'systematized_data': output,
+        Part1.USE_FUSED_ENGINE: fused,
+        Part1.WORKERS: workers,
+    }
+    if state:
+        params[Part1.INCREMENTAL_STATE] = state
+    if run_dir:
+        params[Part1.RUN_DIR] = run_dir
+        params[Part1.RESUME] = resume
+    if sweep:
+        params[Part1.BUFFER_SWEEP] = ', '.join(str(d) for d in sweep)
+        params[Part1.SWEEP_RESULTS] = os.path.splitext(output)[0] + '_sweep.gpkg'
+    params.update(part1_options or {})
+    part1 = processing.run(Part1(), params, feedback=feedback)
+
+    params = {
+        'layer_input': part1['systematized_data'],
+        'labels': field_aggreg,
+        'expected_vals': 'expected_vals',
+        'observed_vals': 'observed_vals',
+        'alpha': alpha,
+    }
+    params.update(part2_options or {})
+    part2 = processing.run(Part2(), params, feedback=feedback)
+
+    results = {
+        'part1': {'systematized_data': part1['systematized_data']},
+        'part2': {key: value for key, value in part2.items() if not key.startswith('batch')},
+        'classes': class_rows(part1['systematized_data'], field_aggreg, alpha),
+        'messages': feedback.messages,
+    }
+    if sweep:
+        results['sweep'] = sweep_rows(part1[Part1.SWEEP_RESULTS])
+    return results
+
+
+def sweep_rows(sweep_results):
+    """Rows (dicts) of the buffer sweep table."""
+    from qgis.core import QgsVectorLayer
+
+    layer = QgsVectorLayer(sweep_results, 'sweep', 'ogr')
+    names = [field.name() for field in layer.fields() if field.name() != 'fid']
+    return [{name: feature[name] for name in names} for feature in layer.getFeatures()]
+
+
+def write_csv(rows, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['label', 'expected', 'observed', 'residual',
+                                               'exceeds_alpha', 'exceeds_bonferroni'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='rppt', description='Randomness Point Pattern Test (RPPT), headless.')
+    parser.add_argument('points', help='layer to be analyzed (points)')
+    parser.add_argument('driver', help='driver layer (polygons)')
+    parser.add_argument('field_aggreg', help='driver field to aggregate')
+    parser.add_argument('--buffer', type=float, default=1000, help='width of the study area around the points')
+    delimitation = parser.add_mutually_exclusive_group()
+    delimitation.add_argument('--concave', type=float, metavar='ALPHA', help='use Concave Hull (0-1)')
+    delimitation.add_argument('--min-bounding', choices=BOUNDING_TYPES, help='use Minimum Bounding Geometry')
+    parser.add_argument('--alpha', type=float, default=0.05, help='significance level')
+    parser.add_argument('--output', help='systematized data file (default: systematized_data.gpkg)')
+    parser.add_argument('--fused', action='store_true', help='use the fused in-memory overlay engine')
+    parser.add_argument('--workers', type=int, default=1, help='parallel workers for the fused engine (0 = all cores)')
+    parser.add_argument('--sweep', type=lambda s: [float(d) for d in s.split(',')], metavar='W1,W2,...',
+                        help='also compare these study area widths (buffer sweep table in the results)')
+    parser.add_argument('--state', help='incremental state file (JSON): later runs only count the appended points')
+    parser.add_argument('--run-dir', help='checkpoint every completed Part 1 stage in this folder')
+    parser.add_argument('--resume', action='store_true', help='continue an interrupted run from the --run-dir checkpoints')
+    parser.add_argument('--profile', help='write the Part 1 per-stage profiling report (JSON) to this file')
+    parser.add_argument('--json', help='write the results as JSON to this file ("-" for stdout)')
+    parser.add_argument('--csv', help='write the per-class residuals as CSV to this file')
+    parser.add_argument('--verbose', action='store_true', help='echo the algorithm messages to stderr')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_rppt(args.points, args.driver, args.field_aggreg, buffer=args.buffer,
+                       concave=args.concave, bounding_type=args.min_bounding, output=args.output,
+                       alpha=args.alpha, fused=args.fused, workers=args.workers, sweep=args.sweep,
+                       state=args.state, run_dir=args.run_dir, resume=args.resume, verbose=args.verbose,
+                       part1_options={'PROFILE_REPORT': args.profile} if args.profile else None)
+    if args.csv:
+        write_csv(results['classes'], args.csv)
+    if args.json == '-' or not (args.json or args.csv):
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    elif args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0 if results['part2'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
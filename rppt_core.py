@@ -0,0 +1,270 @@
+"""
+Computational core of the Randomness Point Pattern Test (RPPT), without QGIS.
+
+Array statistics of Part 2 (critical values, normalization, chi-square,
+standardized residuals, Bonferroni and FDR corrections, per-tile local tests)
+and the area and point shares of Part 1, which the QGIS algorithms delegate
+to; the parallel overlay also counts points with count_points_in.
+
+The rest of the Part 1 overlay on Shapely/GEOS geometries (study area, clip
+and dissolve per class, point counting, systematize) is a reference
+implementation outside QGIS, for scripts and the benchmarks: the plugin runs
+the overlay with QGIS geometries (overlay_engine and the processing chain).
+"""
+import math
+
+import numpy as np
+from scipy.stats import chi2 as chi2_dist
+from scipy.stats import norm
+
+from csr_simulation import simulate_csr  # noqa: F401 (re-exported)
+
+try:
+    import shapely
+except ImportError:  # only the geometry functions need it
+    shapely = None
+
+BUFFER_SEGMENTS = 5
+
+
+def _require_shapely():
+    if shapely is None:
+        raise ImportError('The RPPT geometry functions need Shapely >= 2.0')
+
+
+# Part 2: statistics
+
+def critical_values(alpha):
+    """Upper and lower standard normal limits for a two-sided test at alpha (scalar or array)."""
+    upper_limit = norm.ppf(1 - np.asarray(alpha) / 2)
+    lower_limit = norm.ppf(np.asarray(alpha) / 2)
+    return upper_limit, lower_limit
+
+
+def normalized_values(values):
+    values = np.asarray(values, dtype=float)
+    total = values.sum()
+    return values / total if total != 0 else values
+
+
+def exceeds_limits(residuals, upper_limit, lower_limit):
+    return (residuals > upper_limit) | (residuals < lower_limit)
+
+
+def standardized_residuals(expected, observed):
+    """(observed - expected) / sqrt(expected) of normalized shares."""
+    return (observed - expected) / np.sqrt(expected)
+
+
+def chi_square_test(expected, observed):
+    """
+    Chi-square goodness-of-fit test of the observed against the expected shares
+    (both normalized here). Same statistic and p-value as scipy's chisquare.
+
+    Returns (chi2, p-value, standardized residuals).
+    """
+    expected = normalized_values(expected)
+    observed = normalized_values(observed)
+    res_std = standardized_residuals(expected, observed)
+    chi2 = float(np.dot(res_std, res_std))
+    return chi2, float(chi2_dist.sf(chi2, len(expected) - 1)), res_std
+
+
+def bonferroni(p_value, num_tests, alpha):
+    """Returns (corrected p-value, corrected alpha)."""
+    return p_value * num_tests, alpha / num_tests
+
+
+def fdr(p_values):
+    """Benjamini-Hochberg adjusted p-values (false discovery rate)."""
+    p_values = np.asarray(p_values, dtype=float)
+    n = len(p_values)
+    if n == 0:
+        return p_values
+    order = np.argsort(p_values)
+    ranked = p_values[order] * n / np.arange(1, n + 1)
+    adjusted = np.empty(n)
+    adjusted[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1)
+    return adjusted
+
+
+def residual_p_values(residuals):
+    """Two-sided standard normal p-values of standardized residuals."""
+    return 2 * norm.sf(np.abs(residuals))
+
+
+def grouped_test(groups, expected, observed, alpha):
+    """
+    Chi-square goodness-of-fit test for every group at once.
+
+    groups holds an integer group code per class. Values are normalized per
+    group; returns (per-group statistics, per-class residuals and exceedances).
+    """
+    n_groups = groups.max() + 1 if len(groups) else 0
+    num_tests = np.bincount(groups, minlength=n_groups)
+
+    def normalized(values):
+        total = np.bincount(groups, values, minlength=n_groups)
+        total[total == 0] = 1
+        return values / total[groups]
+
+    expected = normalized(expected)
+    observed = normalized(observed)
+
+    chi2 = np.bincount(groups, (observed - expected) ** 2 / expected, minlength=n_groups)
+    p_valor = chi2_dist.sf(chi2, num_tests - 1)
+    bonferroni_p_value, bonferroni_alpha = bonferroni(p_valor, num_tests, alpha)
+    bonferroni_upper_limit, bonferroni_lower_limit = critical_values(bonferroni_alpha)
+    alpha_upper_limit, alpha_lower_limit = critical_values(alpha)
+
+    res_std = standardized_residuals(expected, observed)
+    group_stats = {
+        'num_tests': num_tests,
+        'chi2': chi2,
+        'p_value': p_valor,
+        'bonferroni_p_value': bonferroni_p_value,
+        'bonferroni_alpha': bonferroni_alpha,
+    }
+    class_stats = {
+        'expected': expected,
+        'observed': observed,
+        'residual': res_std,
+        'exceeds_alpha': exceeds_limits(res_std, alpha_upper_limit, alpha_lower_limit),
+        'exceeds_bonferroni': exceeds_limits(res_std, bonferroni_upper_limit[groups], bonferroni_lower_limit[groups]),
+    }
+    return group_stats, class_stats
+
+
+def local_test(groups, expected, observed, alpha):
+    """
+    Chi-square test of every tile (group of tile x class rows) at once: grouped_test
+    plus the points per tile, the tile p-values adjusted for the number of tiles
+    (Benjamini-Hochberg) and the class residuals exceeding the critical value
+    with the FDR correction. Tiles with fewer than two classes or no points are
+    not tested (NaN statistics, no exceedances).
+    """
+    group_stats, class_stats = grouped_test(groups, expected, observed, alpha)
+    points = np.bincount(groups, observed, minlength=len(group_stats['num_tests']))
+    tested = (group_stats['num_tests'] >= 2) & (points > 0)
+    for key in ('chi2', 'p_value', 'bonferroni_p_value'):
+        group_stats[key] = np.where(tested, group_stats[key], np.nan)
+    fdr_p_value = np.full(len(tested), np.nan)
+    fdr_p_value[tested] = fdr(group_stats['p_value'][tested])
+    group_stats.update(points=points, tested=tested, fdr_p_value=fdr_p_value)
+
+    class_tested = tested[groups]
+    class_p_value = np.ones(len(groups))
+    class_p_value[class_tested] = fdr(residual_p_values(class_stats['residual'][class_tested]))
+    class_stats['exceeds_alpha'] &= class_tested
+    class_stats['exceeds_bonferroni'] &= class_tested
+    class_stats['exceeds_fdr'] = class_p_value < alpha
+    return group_stats, class_stats
+
+
+# Part 1: shares
+
+def shares(values):
+    """Each value over the exact (math.fsum) total of all values; NaN when the total is 0."""
+    values = np.asarray(values, dtype=float)
+    total = math.fsum(values)
+    return values / total if total else np.full(len(values), np.nan)
+
+
+def area_shares(areas):
+    """expected_vals: $area/sum($area)."""
+    return shares(areas)
+
+
+def point_shares(counts):
+    """observed_vals: "NUMPOINTS"/sum("NUMPOINTS")."""
+    return shares(counts)
+
+
+# Part 1: overlay on Shapely geometries
+
+def study_area(points, distance, method='convex', ratio=0.3, segments=BUFFER_SEGMENTS):
+    """
+    Study area around an (n, 2) array of point coordinates: the hull given by
+    method ('concave', 'convex', 'envelope', 'oriented-rectangle' or 'circle')
+    buffered by distance with round caps and joins.
+    """
+    _require_shapely()
+    cloud = shapely.multipoints(np.asarray(points, dtype=float))
+    if method == 'concave':
+        hull = shapely.concave_hull(cloud, ratio=ratio, allow_holes=True)
+    elif method == 'envelope':
+        hull = shapely.envelope(cloud)
+    elif method == 'oriented-rectangle':
+        hull = shapely.oriented_envelope(cloud)
+    elif method == 'circle':
+        hull = shapely.minimum_bounding_circle(cloud)
+    else:
+        hull = shapely.convex_hull(cloud)
+    return shapely.buffer(hull, distance, quad_segs=segments, cap_style='round', join_style='round')
+
+
+def clip_and_dissolve(polygons, classes, area):
+    """
+    Clips the polygons (array of geometries) by area and dissolves them per class
+    value (native:clip + native:aggregate).
+
+    Returns (class values, dissolved geometries) in order of first appearance.
+    """
+    _require_shapely()
+    polygons = np.asarray(polygons)
+    classes = np.asarray(classes)
+    shapely.prepare(area)
+    keep = shapely.intersects(area, polygons)
+    polygons, classes = polygons[keep], classes[keep]
+    inside = shapely.contains(area, polygons)
+    clipped = polygons.copy()
+    clipped[~inside] = shapely.intersection(polygons[~inside], area)
+
+    values, first, inverse = np.unique(classes, return_index=True, return_inverse=True)
+    by_class = np.split(clipped[np.argsort(inverse, kind='stable')], np.cumsum(np.bincount(inverse))[:-1])
+    order = np.argsort(first)
+    geoms = np.empty(len(values), dtype=object)
+    geoms[:] = [shapely.union_all(by_class[i]) for i in order]
+    return values[order], geoms
+
+
+def count_points(points, geoms):
+    """
+    Number of points ((n, 2) coordinates) inside each geometry
+    (native:countpointsinpolygon): one bulk STRtree query over the geometries,
+    evaluated with prepared geometries by GEOS.
+    """
+    _require_shapely()
+    tree = shapely.STRtree(geoms)
+    pairs = tree.query(shapely.points(np.asarray(points, dtype=float)), predicate='within')
+    return np.bincount(pairs[1], minlength=len(geoms))
+
+
+def count_points_in(geom, points):
+    """
+    Number of points ((n, 2) coordinates) inside one geometry: a vectorized
+    prepared test, run by GEOS without holding the GIL.
+    """
+    _require_shapely()
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    shapely.prepare(geom)
+    return int(np.count_nonzero(shapely.contains_xy(geom, points[:, 0], points[:, 1])))
+
+
+def systematize(points, polygons, classes, distance, method='convex', ratio=0.3):
+    """
+    Whole Part 1 on arrays: returns a dict with the class values, dissolved
+    geometries, areas, point counts and the expected/observed shares.
+    """
+    area = study_area(points, distance, method, ratio)
+    values, geoms = clip_and_dissolve(polygons, classes, area)
+    counts = count_points(points, geoms)
+    areas = shapely.area(geoms)
+    return {
+        'classes': values,
+        'geometries': geoms,
+        'areas': areas,
+        'counts': counts,
+        'expected_vals': area_shares(areas),
+        'observed_vals': point_shares(counts),
+    }
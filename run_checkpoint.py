@@ -0,0 +1,95 @@
+"""
+Resumable checkpoints of a Spatial Randomness Part 1 run.
+
+Each completed stage of the fused engine is saved as a JSON file in the run
+folder (geometries as WKB), stamped with a key of the inputs (source, size and
+modification time of the files) and settings; resuming reloads the stages
+saved under the same key. The chain checkpoints its stage outputs through
+stage_graph, in the stages subfolder.
+"""
+import hashlib
+import json
+import os
+
+from qgis.core import QgsGeometry
+
+from incremental_state import class_value
+
+
+def run_key(sources, settings):
+    """Key of a run: the input layer sources (with size and modification time of files) and settings."""
+    digest = hashlib.sha256()
+    parts = []
+    for source in sources:
+        parts.append(source)
+        path = source.split('|')[0]
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            parts.extend([str(stat.st_size), repr(stat.st_mtime)])
+    parts.extend(repr(s) for s in settings)
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def geometry_hex(geom):
+    return bytes(geom.asWkb()).hex()
+
+
+def hex_geometry(wkb_hex):
+    geom = QgsGeometry()
+    geom.fromWkb(bytes.fromhex(wkb_hex))
+    return geom
+
+
+class RunCheckpoints:
+    """Checkpoint folder of one run; without resume, earlier checkpoints are removed."""
+
+    def __init__(self, directory, key, resume=True):
+        self.directory = directory
+        self.key = key
+        os.makedirs(directory, exist_ok=True)
+        if not resume:
+            self.clear()
+
+    def _path(self, stage):
+        return os.path.join(self.directory, f'{stage}.json')
+
+    def load(self, stage):
+        """Returns the data saved for stage, or None when it wasn't completed in this run."""
+        path = self._path(stage)
+        if not os.path.isfile(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        return checkpoint['data'] if checkpoint.get('key') == self.key else None
+
+    def save(self, stage, data):
+        tmp = self._path(stage) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'key': self.key, 'data': data}, f)
+        os.replace(tmp, self._path(stage))
+
+    def save_classes(self, stage, classes, **values):
+        """
+        Saves {class value: geometry} plus per-class dicts given as keywords; class
+        values that aren't numbers or strings are saved as text (class_value).
+        """
+        self.save(stage, {
+            'classes': [[class_value(value), geometry_hex(geom)] for value, geom in classes.items()],
+            **{name: [[class_value(value), v] for value, v in per_class.items()] for name, per_class in values.items()},
+        })
+
+    def load_classes(self, stage):
+        """Returns (classes, {name: per-class dict}) saved by save_classes, or None."""
+        data = self.load(stage)
+        if data is None:
+            return None
+        classes = {value: hex_geometry(wkb_hex) for value, wkb_hex in data.pop('classes')}
+        return classes, {name: dict((value, v) for value, v in pairs) for name, pairs in data.items()}
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json') or name.endswith('.json.tmp'):
+                os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,177 @@
+"""
+Declarative stage graph for the Spatial Randomness Part 1 processing chain.
+
+A stage is declared with its kind, parameters and upstream stages and is
+identified by a fingerprint of the three, so branches declaring the same stage
+share one run and only the stages the requested outputs depend on are run.
+With a store folder, stage outputs are written there under their fingerprint
+and reused while the file inputs (source, size and modification time) are
+unchanged.
+"""
+import hashlib
+import json
+import os
+
+DEFAULT_MAX_SIZE_MB = 1024
+
+
+def _digest(parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class Stage:
+
+    def __init__(self, kind, func, inputs, persist):
+        self.kind = kind
+        self.func = func
+        self.inputs = inputs
+        self.persist = persist
+
+
+class StageGraph:
+    """
+    Stages run on demand through output(); func(inputs, destination, feedback)
+    receives the outputs of the upstream stages, the file to write (None for a
+    temporary output) and the feedback, and returns its own output.
+    """
+
+    def __init__(self, store=None, max_size_mb=DEFAULT_MAX_SIZE_MB, release=None):
+        """
+        release(output) is called once no pending stage needs an output any more;
+        with max_size_mb None the store is never evicted.
+        """
+        self.store = store
+        self.release = release
+        self.max_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb is not None else None
+        if store:
+            os.makedirs(store, exist_ok=True)
+        self.stages = {}
+        self.outputs = {}
+        self.volatile = set()
+        self.consumers = {}
+        self.ran = []
+        self.reused = []
+        self.done = 0
+
+    def source(self, value, source=None):
+        """
+        Declares an input: value is handed to the stages, source is the layer source
+        behind it. Unless it is a file (memory layers, selections, databases),
+        nothing depending on the input is stored.
+        """
+        path = source.split('|')[0] if source else None
+        if path and os.path.isfile(path):
+            stat = os.stat(path)
+            key = _digest(['source', source, stat.st_size, repr(stat.st_mtime)])
+        else:
+            key = _digest(['volatile', value, id(value)])
+            self.volatile.add(key)
+        self.outputs[key] = value
+        return key
+
+    def add(self, kind, func, inputs=(), params=None, persist=True):
+        """Declares a stage and returns its fingerprint, used as the input of later stages."""
+        inputs = tuple(inputs)
+        key = _digest([kind, json.dumps(params, sort_keys=True, default=str)] + list(inputs))
+        if any(i in self.volatile for i in inputs):
+            self.volatile.add(key)
+        if key not in self.stages:
+            self.stages[key] = Stage(kind, func, inputs, persist)
+        return key
+
+    def _path(self, key):
+        stage = self.stages[key]
+        if not self.store or not stage.persist or key in self.volatile:
+            return None
+        return os.path.join(self.store, f'{stage.kind}-{key}.gpkg')
+
+    def pending(self, keys):
+        """Number of stages output(keys) would run; also counts the consumers of every output."""
+        seen = set()
+
+        def visit(key):
+            if key in seen or key in self.outputs:
+                return 0
+            seen.add(key)
+            path = self._path(key)
+            if path and os.path.isfile(path):
+                return 0
+            for i in self.stages[key].inputs:
+                self.consumers[i] = self.consumers.get(i, 0) + 1
+            return 1 + sum(visit(i) for i in self.stages[key].inputs)
+        return sum(visit(key) for key in keys)
+
+    def output(self, key, feedback=None):
+        """
+        Returns the output of stage key, running it and its upstream stages when
+        needed, or None when feedback was canceled. feedback (multi-step) moves one
+        step per stage run.
+        """
+        if key in self.outputs:
+            return self.outputs[key]
+        stage = self.stages[key]
+        path = self._path(key)
+        if path and os.path.isfile(path):
+            os.utime(path)  # recently used
+            self.reused.append(stage.kind)
+            self.outputs[key] = path
+            return path
+
+        inputs = []
+        for i in stage.inputs:
+            inputs.append(self.output(i, feedback))
+            if feedback is not None and feedback.isCanceled():
+                return None
+        partial = path[:-len('.gpkg')] + '.part.gpkg' if path else None
+        output = stage.func(inputs, partial, feedback)
+        if feedback is not None and feedback.isCanceled():
+            # a canceled child still returns its truncated output: never keep it
+            if partial and os.path.isfile(partial):
+                os.remove(partial)
+            return None
+        if partial and output == partial and os.path.isfile(partial):
+            os.replace(partial, path)
+            output = path
+        self.ran.append(stage.kind)
+        self.done += 1
+        for i in stage.inputs:
+            if i in self.consumers:
+                self.consumers[i] -= 1
+                if self.consumers[i] == 0 and self.release is not None:
+                    self.release(self.outputs[i])
+        if feedback is not None:
+            feedback.setCurrentStep(self.done)
+        self.outputs[key] = output
+        return output
+
+    def evict(self):
+        """
+        Removes the least recently used stored outputs until the store fits in
+        max_bytes; the outputs of this graph are kept.
+        """
+        if not self.store or self.max_bytes is None:
+            return
+        current = set(self.outputs.values())
+        entries = []
+        for name in os.listdir(self.store):
+            path = os.path.join(self.store, name)
+            if name.endswith('.gpkg') and not name.endswith('.part.gpkg') and path not in current:
+                entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        """Removes every stored output."""
+        if not self.store:
+            return
+        for name in os.listdir(self.store):
+            if name.endswith('.gpkg'):
+                os.remove(os.path.join(self.store, name))
@@ -0,0 +1,119 @@
+"""
+Per-stage timing and memory instrumentation for the Spatial Randomness pipeline.
+
+Records wall time, CPU time, resident memory (current and peak), bytes read
+and written and the input/output feature and vertex counts of every stage, as
+a JSON-ready report.
+"""
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+STAGE_KEYS = ['stage', 'wall_s', 'cpu_s', 'rss_mb', 'peak_rss_mb', 'bytes_read', 'bytes_written',
+              'input_features', 'input_vertices', 'output_features', 'output_vertices']
+
+
+def rss_mb():
+    """Current resident set size in MB, or None when it can't be read."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2 ** 20
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    """Peak resident set size of the process so far in MB, or None."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 2 ** 20
+    return None
+
+
+def io_bytes():
+    """
+    (bytes read, bytes written) by the process so far through read/write calls,
+    so network file systems count too; (None, None) when they can't be read.
+    """
+    if psutil is not None:
+        try:
+            io = psutil.Process().io_counters()
+        except (AttributeError, psutil.Error):  # not available on macOS
+            return None, None
+        return getattr(io, 'read_chars', io.read_bytes), getattr(io, 'write_chars', io.write_bytes)
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(':') for line in f)
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+class StageProfiler:
+    """
+    Collects one record per stage. When disabled, stage() still yields a record
+    but nothing is measured, so callers don't need to branch.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the enclosed block. The yielded dict can be filled with the
+        input_*/output_* counts; they are measured outside the timed region by
+        the caller when needed.
+        """
+        record = dict.fromkeys(STAGE_KEYS)
+        record['stage'] = name
+        if not self.enabled:
+            yield record
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        read, written = io_bytes()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = time.perf_counter() - wall
+            record['cpu_s'] = time.process_time() - cpu
+            if read is not None:
+                read_end, written_end = io_bytes()
+                record['bytes_read'] = read_end - read
+                record['bytes_written'] = written_end - written
+            record['rss_mb'] = rss_mb()
+            record['peak_rss_mb'] = peak_rss_mb()
+            self.stages.append(record)
+
+    def report(self):
+        return {
+            'stages': self.stages,
+            'total_wall_s': sum(s['wall_s'] for s in self.stages),
+            'total_cpu_s': sum(s['cpu_s'] for s in self.stages),
+            'peak_rss_mb': max((s['peak_rss_mb'] or 0 for s in self.stages), default=None),
+            'total_bytes_read': sum(s['bytes_read'] or 0 for s in self.stages),
+            'total_bytes_written': sum(s['bytes_written'] or 0 for s in self.stages),
+        }
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
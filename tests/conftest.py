@@ -0,0 +1,13 @@
+"""Checks of the modules that run without QGIS (rppt_core, csr_simulation, stage_graph)."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def rng():
+    import numpy as np
+    return np.random.default_rng(20240501)
@@ -0,0 +1,34 @@
+"""csr_simulation: Monte Carlo chi-square test under CSR."""
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from csr_simulation import simulate_csr  # noqa: E402
+
+
+def shares(rng, n):
+    expected = rng.random(n) + 0.1
+    observed = rng.poisson(50 * expected)
+    return expected / expected.sum(), observed / observed.sum()
+
+
+def test_simulate_csr_independent_of_workers(rng):
+    expected, observed = shares(rng, 8)
+    # small chunks so that the workers get several chunks each
+    args = (expected, observed, 500, 999)
+    serial = simulate_csr(*args, seed=7, workers=1, chunk_bytes=8 * 8 * 100)
+    threaded = simulate_csr(*args, seed=7, workers=4, chunk_bytes=8 * 8 * 100)
+    assert serial['p_value'] == threaded['p_value']
+    for key in serial:
+        np.testing.assert_array_equal(serial[key], threaded[key])
+
+
+def test_simulate_csr_p_values(rng):
+    expected, observed = shares(rng, 5)
+    result = simulate_csr(expected, expected, 1000, 199, seed=3)
+    # the observed shares equal the expected ones: no replicate is closer
+    assert result['chi2'] == 0
+    assert result['p_value'] == 1
+    result = simulate_csr(expected, observed, 1000, 199, seed=3)
+    assert 1 / 200 <= result['p_value'] <= 1
+    assert ((result['class_p_value'] > 0) & (result['class_p_value'] <= 1)).all()
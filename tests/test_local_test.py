@@ -0,0 +1,32 @@
+"""rppt_core.local_test: the chi-square test per tile."""
+import pytest
+
+np = pytest.importorskip('numpy')
+stats = pytest.importorskip('scipy.stats')
+
+import rppt_core  # noqa: E402
+
+
+def test_local_test_skips_untestable_tiles(rng):
+    # tile 0: three classes with points, tile 1: a single class, tile 2: no points
+    groups = np.array([0, 0, 0, 1, 2, 2])
+    expected = np.array([1.0, 2.0, 3.0, 1.0, 1.0, 1.0])
+    observed = np.array([5.0, 1.0, 9.0, 4.0, 0.0, 0.0])
+    group_stats, class_stats = rppt_core.local_test(groups, expected, observed, 0.05)
+    reference = stats.chisquare(observed[:3] / 15, expected[:3] / 6)
+    assert group_stats['chi2'][0] == pytest.approx(reference.statistic)
+    assert group_stats['p_value'][0] == pytest.approx(reference.pvalue)
+    assert list(group_stats['tested']) == [True, False, False]
+    assert np.isnan(group_stats['p_value'][1:]).all()
+    assert list(group_stats['points']) == [15, 4, 0]
+    assert not class_stats['exceeds_fdr'][3:].any()
+
+
+def test_local_test_fdr_over_tiles(rng):
+    n_tiles, n_classes = 20, 4
+    groups = np.repeat(np.arange(n_tiles), n_classes)
+    expected = rng.random(len(groups)) + 0.1
+    observed = rng.poisson(30 * expected).astype(float) + 1
+    group_stats, _ = rppt_core.local_test(groups, expected, observed, 0.05)
+    assert group_stats['tested'].all()
+    assert group_stats['fdr_p_value'] == pytest.approx(stats.false_discovery_control(group_stats['p_value']))
@@ -0,0 +1,62 @@
+"""rppt_core against the scipy reference results."""
+import pytest
+
+np = pytest.importorskip('numpy')
+stats = pytest.importorskip('scipy.stats')
+
+import rppt_core  # noqa: E402
+
+
+def shares(rng, n):
+    expected = rng.random(n) + 0.1
+    observed = rng.poisson(50 * expected)
+    return expected / expected.sum(), observed / observed.sum()
+
+
+def test_chi_square_matches_scipy(rng):
+    expected, observed = shares(rng, 12)
+    chi2, p_value, residuals = rppt_core.chi_square_test(expected, observed)
+    reference = stats.chisquare(observed, expected)
+    assert chi2 == pytest.approx(reference.statistic)
+    assert p_value == pytest.approx(reference.pvalue)
+    assert residuals == pytest.approx((observed - expected) / np.sqrt(expected))
+
+
+def test_fdr_matches_scipy(rng):
+    p_values = rng.random(200) ** 3
+    assert rppt_core.fdr(p_values) == pytest.approx(stats.false_discovery_control(p_values))
+    assert len(rppt_core.fdr([])) == 0
+
+
+def test_grouped_test_matches_scipy_per_group(rng):
+    sizes = [3, 7, 5]
+    groups = np.repeat(np.arange(len(sizes)), sizes)
+    expected = rng.random(len(groups)) + 0.1
+    observed = rng.poisson(40 * expected).astype(float)
+    group_stats, class_stats = rppt_core.grouped_test(groups, expected, observed, 0.05)
+    for g, n in enumerate(sizes):
+        rows = groups == g
+        exp = expected[rows] / expected[rows].sum()
+        obs = observed[rows] / observed[rows].sum()
+        reference = stats.chisquare(obs, exp)
+        assert group_stats['num_tests'][g] == n
+        assert group_stats['chi2'][g] == pytest.approx(reference.statistic)
+        assert group_stats['p_value'][g] == pytest.approx(reference.pvalue)
+        assert group_stats['bonferroni_p_value'][g] == pytest.approx(reference.pvalue * n)
+        assert class_stats['residual'][rows] == pytest.approx((obs - exp) / np.sqrt(exp))
+
+
+
+def test_shares():
+    assert rppt_core.area_shares([1.0, 3.0]) == pytest.approx([0.25, 0.75])
+    assert np.isnan(rppt_core.point_shares([0, 0])).all()
+
+
+
+def test_count_points_in(rng):
+    pytest.importorskip('shapely')
+    points = rng.random((1000, 2))
+    square = rppt_core.shapely.box(0.25, 0.25, 0.75, 0.75)
+    inside = ((points > 0.25) & (points < 0.75)).all(axis=1).sum()
+    assert rppt_core.count_points_in(square, points) == inside
+    assert rppt_core.count_points(points, [square])[0] == inside
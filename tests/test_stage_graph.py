@@ -0,0 +1,122 @@
+"""Deduplication, storage and reuse of stage_graph stages."""
+import os
+
+import stage_graph
+
+
+class Feedback:
+
+    def __init__(self, cancel_in=None):
+        self.canceled = False
+        self.cancel_in = cancel_in
+
+    def isCanceled(self):
+        return self.canceled
+
+    def setCurrentStep(self, step):
+        pass
+
+
+def writer(calls, kind):
+    def func(inputs, destination, feedback):
+        calls.append(kind)
+        if feedback is not None and feedback.cancel_in == kind:
+            feedback.canceled = True
+        if destination is None:
+            return f'{kind}({",".join(map(str, inputs))})'
+        with open(destination, 'w') as f:
+            f.write(kind)
+        return destination
+    return func
+
+
+def declare(graph, calls, source):
+    hull = graph.add('Hull', writer(calls, 'Hull'), [source], {'type': 0})
+    buffer = graph.add('Buffer', writer(calls, 'Buffer'), [hull], {'distance': 100})
+    # same kind, params and inputs: the same stage
+    again = graph.add('Buffer', writer(calls, 'Buffer'), [hull], {'distance': 100})
+    return hull, buffer, again
+
+
+def input_file(tmp_path):
+    path = tmp_path / 'points.gpkg'
+    path.write_text('points')
+    return str(path)
+
+
+def test_identical_stages_run_once():
+    calls = []
+    graph = stage_graph.StageGraph()
+    _, buffer, again = declare(graph, calls, graph.source('points'))
+    assert buffer == again
+    assert graph.pending([buffer, again]) == 2
+    assert graph.output(buffer) == graph.output(again) == 'Buffer(Hull(points))'
+    assert calls == ['Hull', 'Buffer']
+
+
+def test_stored_outputs_reused_while_input_unchanged(tmp_path):
+    store = str(tmp_path / 'stages')
+    source = input_file(tmp_path)
+    calls = []
+    graph = stage_graph.StageGraph(store)
+    _, buffer, _ = declare(graph, calls, graph.source('points', source))
+    first = graph.output(buffer)
+    assert os.path.isfile(first)
+
+    graph = stage_graph.StageGraph(store)
+    _, buffer, _ = declare(graph, calls, graph.source('points', source))
+    assert graph.pending([buffer]) == 0
+    assert graph.output(buffer) == first
+    assert calls == ['Hull', 'Buffer']
+    assert graph.reused == ['Buffer']
+
+
+def test_volatile_inputs_not_stored(tmp_path):
+    store = str(tmp_path / 'stages')
+    calls = []
+    graph = stage_graph.StageGraph(store)
+    _, buffer, _ = declare(graph, calls, graph.source('memory layer'))
+    graph.output(buffer)
+    assert os.listdir(store) == []
+
+
+def test_canceled_stage_not_stored(tmp_path):
+    store = str(tmp_path / 'stages')
+    source = input_file(tmp_path)
+    calls = []
+    graph = stage_graph.StageGraph(store)
+    _, buffer, _ = declare(graph, calls, graph.source('points', source))
+    assert graph.output(buffer, Feedback(cancel_in='Buffer')) is None
+    assert [name for name in os.listdir(store) if name.startswith('Buffer')] == []
+
+    graph = stage_graph.StageGraph(store)
+    _, buffer, _ = declare(graph, calls, graph.source('points', source))
+    assert graph.pending([buffer]) == 1
+    graph.output(buffer, Feedback())
+    assert graph.ran == ['Buffer']
+    assert graph.reused == ['Hull']
+
+
+def test_release_after_last_consumer():
+    calls, released = [], []
+    graph = stage_graph.StageGraph(release=released.append)
+    hull, buffer, _ = declare(graph, calls, graph.source('points'))
+    graph.pending([buffer])
+    graph.output(buffer)
+    assert released == ['points', 'Hull(points)']
+
+
+def test_evict_keeps_outputs_of_the_run(tmp_path):
+    store = str(tmp_path / 'stages')
+    source = input_file(tmp_path)
+    calls = []
+    graph = stage_graph.StageGraph(store, max_size_mb=1e-6)
+    _, buffer, _ = declare(graph, calls, graph.source('points', source))
+    output = graph.output(buffer)
+    graph.evict()
+    assert os.path.isfile(output)
+
+    stage_graph.StageGraph(store, max_size_mb=None).evict()
+    assert os.path.isfile(output)
+    stage_graph.StageGraph(store, max_size_mb=1e-6).evict()
+    assert os.listdir(store) == []